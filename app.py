@@ -1,11 +1,43 @@
 # app.py
-from flask import Flask, render_template_string, jsonify, send_file, abort, request, redirect, url_for, session
-from functools import wraps
+import time
+_import_started = time.perf_counter()  # for the startup report
+
+from flask import Flask, render_template_string, jsonify, send_file, abort, request, redirect, url_for, session, g
+from flask import before_render_template, template_rendered, has_request_context
+from flask.templating import Environment as FlaskEnvironment
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from array import array
 import json, os
+import bisect
+import cProfile
+import io
+import logging
+import logging.handlers
+import queue
+import pstats
+import sys
+import tracemalloc
 from werkzeug.utils import secure_filename
 import re
+import hashlib
+import heapq
+import sqlite3
+import threading
+import atexit
 from html import unescape
 from datetime import datetime
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines run a single process; the thread lock is enough
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is simply not reported
+    resource = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')  # Use environment variable in production
@@ -16,29 +48,137 @@ app.config['SESSION_COOKIE_SECURE'] = 'RENDER' in os.environ  # True on Render,
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
-# Track login history for users (format: {user_id: [{'timestamp': ..., 'ip': ..., 'user_agent': ..., 'is_current': bool}]})
-login_history = {}
-
 # History and recently viewed functions
-def add_to_history(session, quiz_data):
-    """Add a quiz attempt to user's history"""
-    if 'history' not in session:
-        session['history'] = []
-    
-    # Add timestamp
-    quiz_data['timestamp'] = datetime.now().isoformat()
-    
-    # Add to history (limit to 50 entries)
-    session['history'].insert(0, quiz_data)
-    if len(session['history']) > 50:
-        session['history'] = session['history'][:50]
-    
-    # Save session
-    session.modified = True
+# Attempts older than the last page are still kept in the store; this only sizes a page
+HISTORY_PAGE_SIZE = 20
+
+def encode_answers(answers):
+    """Pack a per-question answer vector (choice index, -1 = unanswered) into one byte per question"""
+    return array('b', answers).tobytes()
+
+def decode_answers(blob):
+    """Unpack an answer vector stored by encode_answers"""
+    return array('b', blob or b'').tolist()
+
+def _parse_attempt(quiz_data, user_id=None):
+    """Validate a posted quiz result and return the attempt to grade (raises ValueError)"""
+    if not isinstance(quiz_data, dict):
+        raise ValueError("quiz result must be a JSON object")
+    file_name = quiz_data.get('file')
+    if not isinstance(file_name, str) or not file_name:
+        raise ValueError("'file' is required")
+    quiz = resolve_quiz(file_name, user_id)
+    if quiz is None:
+        raise ValueError("unknown quiz file")
+
+    answers = quiz_data.get('answers') or []
+    if not isinstance(answers, list):
+        raise ValueError("'answers' must be a list of choice indexes")
+    try:
+        answers = [-1 if a is None else int(a) for a in answers]
+        duration_seconds = int(quiz_data.get('duration_seconds') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("'answers' and 'duration_seconds' must be numbers")
+    if any(a < -1 or a > 25 for a in answers):
+        raise ValueError("choice index out of range")
+    plan = get_shuffle_plan(quiz, user_id) if quiz_data.get('shuffled') else None
+    if plan is not None:
+        # Answers of a shuffled page are in delivery order
+        answers = unshuffle_answers(plan, answers, len(quiz['questions']))
+
+    content_version = quiz_data.get('content_version')
+    return {
+        'file': quiz['file'],
+        'quiz': quiz,
+        'quiz_name': str(quiz_data.get('quiz_name') or quiz['name']),
+        'duration_seconds': duration_seconds,
+        'answers': answers,
+        'content_version': None if content_version is None else str(content_version)[:64],
+        'plan': plan,
+    }
 
-def get_user_history(session):
-    """Get user's quiz history"""
-    return session.get('history', [])
+def add_to_history(user_id, quiz_data):
+    """Grade a posted attempt server-side, append it to the attempt store and return (attempt_id, result)"""
+    attempt = _parse_attempt(quiz_data, user_id)
+    key = attempt['quiz']['key']
+    graded = grade_attempts(key, [attempt['answers']])
+    result = graded_result(key, graded, 0)
+    answers = graded['answers'][0].tolist()
+    # Pages rendered before the version was sent are graded (and stored) against the file as it is now
+    content_version = attempt['content_version'] or key['version']
+    timestamp = datetime.now().isoformat()
+    ordinals = attempt['quiz']['ordinals']
+
+    with store_transaction() as conn:
+        cur = conn.execute(
+            'INSERT INTO attempts (user_id, file, quiz_name, timestamp, duration_seconds, score, '
+            'total_questions, correct, incorrect, unanswered, percentage, answers, content_version) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (user_id, attempt['file'], attempt['quiz_name'], timestamp,
+             attempt['duration_seconds'], result['score'], result['total_questions'],
+             result['correct'], result['incorrect'], result['unanswered'],
+             result['percentage'], encode_answers(answers), content_version)
+        )
+        previously_seen, seen = update_progress_bitsets(conn, user_id, ordinals, graded)
+        update_mastery_rollups(conn, user_id, attempt['file'], key, graded, timestamp, previously_seen, seen)
+    attempt_id = cur.lastrowid
+    _after_attempt_recorded(user_id, ordinals, graded)
+    if attempt['plan'] is not None:
+        # The page shows the questions in delivery order; the attempt is stored in file order
+        result = shuffle_result(attempt['plan'], result)
+    return attempt_id, result
+
+def _after_attempt_recorded(user_id, ordinals, graded):
+    """Update the incremental aggregates that are derived from graded attempts"""
+    try:
+        record_attempt_stats(ordinals, graded['answers'][0], graded['correct'][0])
+    except Exception as e:
+        # The attempt itself is stored; a failed aggregate update must not lose it
+        print(f"Error updating question statistics: {e}")
+    try:
+        update_schedule(user_id, ordinals, graded['answered'][0], graded['correct'][0])
+    except Exception as e:
+        print(f"Error updating review schedule: {e}")
+
+# Summary columns returned by history queries (the answer vector is only loaded on demand)
+ATTEMPT_SUMMARY_COLUMNS = ('id, user_id, file, quiz_name, timestamp, duration_seconds, score, '
+                           'total_questions, correct, incorrect, unanswered, percentage, content_version')
+
+def get_user_history(user_id, limit=HISTORY_PAGE_SIZE, offset=0):
+    """Get a page of a user's quiz attempts, newest first"""
+    rows = get_store().execute(
+        f'SELECT {ATTEMPT_SUMMARY_COLUMNS} FROM attempts WHERE user_id = ? '
+        'ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+        (user_id, limit, offset)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def count_user_history(user_id):
+    """Number of attempts stored for a user"""
+    return get_store().execute('SELECT COUNT(*) FROM attempts WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+def get_file_history(file_name, limit=HISTORY_PAGE_SIZE, offset=0):
+    """Get a page of attempts on one file across all users, newest first"""
+    rows = get_store().execute(
+        f'SELECT {ATTEMPT_SUMMARY_COLUMNS} FROM attempts WHERE file = ? '
+        'ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+        (file_name, limit, offset)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_attempt(attempt_id, user_id=None):
+    """Load one attempt including its decoded answer vector (optionally scoped to a user)"""
+    query = 'SELECT * FROM attempts WHERE id = ?'
+    params = [attempt_id]
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    row = get_store().execute(query, params).fetchone()
+    if row is None:
+        return None
+    attempt = dict(row)
+    attempt['answers'] = decode_answers(attempt['answers'])
+    return attempt
 
 def add_to_recently_viewed(session, item_data):
     """Add an item to user's recently viewed list"""
@@ -120,6 +260,18 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def session_is_admin():
+    """True when the logged-in user currently has the admin role in users.json"""
+    if 'user_id' not in session:
+        return False
+    users_data = load_users()
+    user = None
+    for u in users_data['users']:
+        if u['id'] == session['user_id']:
+            user = u
+            break
+    return bool(user) and user.get('role') == 'admin'
+
 # Admin required decorator
 def admin_required(f):
     @wraps(f)
@@ -128,14 +280,7 @@ def admin_required(f):
             return redirect(url_for('login'))
         
         # Check if user is admin
-        users_data = load_users()
-        user = None
-        for u in users_data['users']:
-            if u['id'] == session['user_id']:
-                user = u
-                break
-        
-        if not user or user.get('role') != 'admin':
+        if not session_is_admin():
             return render_template_string(MENU_TEMPLATE, files=[], total_files=0, debug_modules=0, debug_mocks=0, error="Access denied. Admin privileges required.", user_role=session.get('user_role', 'user'))
         
         return f(*args, **kwargs)
@@ -160,6 +305,8 @@ if data_folder_temp is None:
 else:
     DATA_FOLDER = data_folder_temp
 UPLOAD_FOLDER = DATA_FOLDER
+# Bump on deploys that edit data files in place; caches keyed on data_manifest() are then rebuilt
+DATA_VERSION = os.environ.get('DATA_VERSION')
 
 # places from which we allow loading files (absolute paths)
 ALLOWED_DIRS = [
@@ -176,6 +323,191 @@ def is_allowed_path(abs_path):
             return True
     return False
 
+def questions_for_client(questions, is_mock):
+    """Questions as sent to the quiz page: mock exams are graded server-side, so drop their answers"""
+    if not is_mock:
+        return questions
+    return [{k: q[k] for k in ('id', 'title', 'stem', 'choices')} for q in questions]
+
+def data_file_path(file_name):
+    """Absolute path of a quiz file in DATA_FOLDER, or None if it is missing or not allowed"""
+    path = os.path.join(DATA_FOLDER, os.path.basename(file_name))
+    if os.path.exists(path) and is_allowed_path(path):
+        return os.path.abspath(path)
+    return None
+
+# ---------- persistent store ----------
+# A single SQLite database shared by every gunicorn worker, so state written by one
+# worker is visible to the others and survives restarts. Point STORE_FOLDER at a
+# persistent disk on Render.
+STORE_FOLDER = os.environ.get('STORE_FOLDER', os.path.join(BASE_DIR, 'instance'))
+STORE_DB_PATH = os.path.join(STORE_FOLDER, 'cfa_store.sqlite3')
+if 'RENDER' in os.environ and 'STORE_FOLDER' not in os.environ:
+    # The app directory is rebuilt on every deploy, so the default store would silently lose all history
+    raise RuntimeError("STORE_FOLDER must point at a persistent disk on Render (see render.yaml)")
+
+# Number of login sessions kept per user
+MAX_LOGIN_SESSIONS = 20
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS login_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    ip TEXT,
+    user_agent TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_login_sessions_user ON login_sessions (user_id, id);
+
+-- Append-only record of finished quizzes; answers is one signed byte per question
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    quiz_name TEXT,
+    timestamp TEXT NOT NULL,
+    duration_seconds INTEGER,
+    score INTEGER,
+    total_questions INTEGER,
+    correct INTEGER,
+    incorrect INTEGER,
+    unanswered INTEGER,
+    percentage INTEGER,
+    answers BLOB,
+    content_version TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_user_time ON attempts (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attempts_file_time ON attempts (file, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attempts_user_file_time ON attempts (user_id, file, timestamp);
+
+-- Append-only log of in-progress quiz snapshots; state NULL marks a finished/discarded session.
+-- Only the newest row per (user_id, file) by queue timestamp matters (workers flush their buffers
+-- in any order, so the row id is not the order); older rows are removed by compaction.
+CREATE TABLE IF NOT EXISTS autosave_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_autosave_user_file ON autosave_log (user_id, file, id);
+CREATE INDEX IF NOT EXISTS idx_autosave_user_file_time ON autosave_log (user_id, file, timestamp);
+
+-- Per-user accuracy/coverage per data file and per category, maintained on every stored attempt
+CREATE TABLE IF NOT EXISTS mastery_rollups (
+    user_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    answered INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    questions_total INTEGER,
+    questions_seen INTEGER NOT NULL DEFAULT 0,
+    best_percentage REAL,
+    last_percentage REAL,
+    last_attempt TEXT,
+    PRIMARY KEY (user_id, scope, key)
+);
+
+-- Packed per-user bitsets (seen/correct/flagged) indexed by question ordinal
+CREATE TABLE IF NOT EXISTS user_bitsets (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    bits BLOB NOT NULL,
+    PRIMARY KEY (user_id, kind)
+);
+
+-- Virtual quizzes (flagged questions, review decks, ...) as lists of question ordinals
+CREATE TABLE IF NOT EXISTS decks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    created TEXT NOT NULL,
+    is_mock INTEGER NOT NULL DEFAULT 0,
+    items BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_decks_user_kind ON decks (user_id, kind, id);
+
+-- Spaced-repetition state per user: packed SRS_DTYPE records, bumped 'updated' on every change
+CREATE TABLE IF NOT EXISTS review_schedules (
+    user_id TEXT PRIMARY KEY,
+    state BLOB NOT NULL,
+    updated INTEGER NOT NULL
+);
+
+-- Stable global ordinal per question, keyed by item id
+CREATE TABLE IF NOT EXISTS question_ordinals (
+    item_id TEXT PRIMARY KEY,
+    ordinal INTEGER NOT NULL UNIQUE
+);
+
+-- Per-question interaction events posted in batches by the quiz pages
+CREATE TABLE IF NOT EXISTS answer_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    content_version TEXT,
+    event TEXT NOT NULL,
+    question INTEGER NOT NULL,
+    choice INTEGER,
+    duration_ms INTEGER,
+    client_ts INTEGER,
+    received_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answer_events_user_file ON answer_events (user_id, file, id);
+CREATE INDEX IF NOT EXISTS idx_answer_events_file_question ON answer_events (file, question);
+"""
+
+# Columns added after a table was first released: (table, column, declaration)
+STORE_MIGRATIONS = [
+    ('attempts', 'content_version', 'TEXT'),
+]
+
+_store_local = threading.local()
+_store_schema_lock = threading.Lock()
+_store_schema_ready = False
+
+def _ensure_store_schema(conn):
+    """Create the store tables once per process"""
+    global _store_schema_ready
+    with _store_schema_lock:
+        if _store_schema_ready:
+            return
+        # WAL lets readers in other workers proceed while one worker writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(STORE_SCHEMA)
+        for table, column, decl in STORE_MIGRATIONS:
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+        _store_schema_ready = True
+
+def get_store():
+    """Return this thread's connection to the shared store"""
+    conn = getattr(_store_local, 'conn', None)
+    if conn is None:
+        os.makedirs(STORE_FOLDER, exist_ok=True)
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves in store_transaction()
+        conn = sqlite3.connect(STORE_DB_PATH, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _ensure_store_schema(conn)
+        _store_local.conn = conn
+    return conn
+
+@contextmanager
+def store_transaction():
+    """Run a block of statements atomically against the store"""
+    conn = get_store()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
 
 def clean_html(raw_html):
     """Strip HTML tags for plain text rendering (used for legacy content)"""
@@ -222,6 +554,14 @@ def load_questions_from_file(path):
     with open(path, "r", encoding="utf-8") as f:
         raw = json.load(f)
 
+    return normalize_questions(raw), raw
+
+
+def normalize_questions(raw):
+    """
+    Normalize the items of an already parsed quiz file.
+    Returns the questions list described in load_questions_from_file.
+    """
     items = _find_items_structure(raw)
 
     def get_entry(item):
@@ -301,7 +641,2012 @@ def load_questions_from_file(path):
         }
         questions.append(q)
 
-    return questions, raw
+    return questions
+
+
+def correct_choice_index(question):
+    """Index of the correct choice within question['choices'], or -1 if unknown"""
+    correct = question.get("correct")
+    if correct:
+        for idx, c in enumerate(question.get("choices") or []):
+            if c.get("id") == correct:
+                return idx
+    return -1
+
+# ---------- metrics ----------
+# Prometheus-style metrics served at /metrics. Every thread records into its own shard (no lock
+# on the hot path); a scrape sums the shards. Values are per worker process, labelled with its pid.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = {
+    'cfa_http_requests_total': ('counter', 'HTTP requests by route, method and status'),
+    'cfa_http_request_duration_seconds': ('histogram', 'HTTP request latency by route'),
+    'cfa_http_response_bytes_total': ('counter', 'Response body bytes sent by route'),
+    'cfa_http_requests_in_flight': ('gauge', 'Requests currently being handled'),
+    'cfa_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit/miss)'),
+    'cfa_json_parse_seconds': ('histogram', 'Time spent parsing data files'),
+    'cfa_template_render_seconds': ('histogram', 'Template render time by endpoint'),
+    'cfa_request_phase_seconds': ('histogram', 'Time per request phase (resolve, load, parse, normalize, compile, render)'),
+}
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+_metric_shards = []
+_metric_shards_lock = threading.Lock()
+_metric_local = threading.local()
+
+def _metric_shard():
+    """This thread's shard: {'counters': {(name, labels): value}, 'histograms': {(name, labels): [buckets..., sum]}}"""
+    shard = getattr(_metric_local, 'shard', None)
+    if shard is None:
+        shard = _metric_local.shard = {'counters': {}, 'histograms': {}}
+        with _metric_shards_lock:
+            _metric_shards.append(shard)
+    return shard
+
+def inc_metric(name, labels=(), value=1):
+    """Add to a counter (or, with a negative value, a gauge)"""
+    counters = _metric_shard()['counters']
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+def observe_metric(name, seconds, labels=()):
+    """Record one observation in a histogram"""
+    histograms = _metric_shard()['histograms']
+    key = (name, labels)
+    slots = histograms.get(key)
+    if slots is None:
+        slots = histograms[key] = [0] * (len(METRIC_BUCKETS) + 2)  # buckets, +Inf, sum
+    slots[bisect.bisect_left(METRIC_BUCKETS, seconds)] += 1
+    slots[-1] += seconds
+
+def _metric_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def render_metrics():
+    """
+    All metrics in the Prometheus text exposition format. Values cover this worker process only, so
+    every series carries a worker="<pid>" label; sum over it (e.g. sum without (worker)) for totals.
+    """
+    worker = [('worker', os.getpid())]
+    counters, histograms = {}, {}
+    with _metric_shards_lock:
+        shards = list(_metric_shards)
+    for shard in shards:
+        for key, value in list(shard['counters'].items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, slots in list(shard['histograms'].items()):
+            total = histograms.setdefault(key, [0] * len(slots))
+            for i, v in enumerate(slots):
+                total[i] += v
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'histogram':
+            for (metric, labels), slots in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRIC_BUCKETS + ('+Inf',), slots[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_metric_labels(worker, list(labels) + [("le", bound)])} {cumulative}')
+                lines.append(f'{name}_sum{_metric_labels(worker, labels)} {slots[-1]:.6f}')
+                lines.append(f'{name}_count{_metric_labels(worker, labels)} {cumulative}')
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_metric_labels(worker, labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+def _metric_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def count_cache_lookup(cache, hit):
+    """Count a cache lookup in the metrics and, during a request, in that request's log context"""
+    result = 'hit' if hit else 'miss'
+    inc_metric('cfa_cache_requests_total', (('cache', cache), ('result', result)))
+    if has_request_context() and 'metrics_start' in g:
+        lookups = g.cache_lookups.setdefault(cache, {'hit': 0, 'miss': 0})
+        lookups[result] += 1
+
+@contextmanager
+def timing_span(phase):
+    """
+    Time one phase of the current request. Spans feed the Server-Timing response header, the
+    phase histogram and the request log; outside a request (e.g. warmup) they are not recorded.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(phase, time.perf_counter() - start)
+
+def record_span(phase, seconds):
+    if has_request_context() and 'metrics_start' in g:
+        g.spans[phase] = g.spans.get(phase, 0.0) + seconds
+        observe_metric('cfa_request_phase_seconds', seconds, (('phase', phase),))
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.spans = {}
+    g.cache_lookups = {}
+    g.data_files = {}
+    g.quiz_file = None
+    inc_metric('cfa_http_requests_in_flight')
+
+@app.after_request
+def _record_request_metrics(response):
+    route = _metric_route()
+    elapsed = time.perf_counter() - g.metrics_start
+    inc_metric('cfa_http_requests_total', (('route', route), ('method', request.method), ('status', response.status_code)))
+    observe_metric('cfa_http_request_duration_seconds', elapsed, (('route', route),))
+    response.headers['Server-Timing'] = ', '.join(
+        [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in g.spans.items()] + [f'total;dur={elapsed * 1000:.2f}']
+    )
+    if not response.is_streamed and response.content_length:
+        inc_metric('cfa_http_response_bytes_total', (('route', route),), response.content_length)
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    if 'metrics_start' in g:
+        inc_metric('cfa_http_requests_in_flight', value=-1)
+
+@before_render_template.connect_via(app)
+def _start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_render_time(sender, template, context, **extra):
+    if 'render_start' in g:
+        seconds = time.perf_counter() - g.pop('render_start')
+        observe_metric('cfa_template_render_seconds', seconds, (('endpoint', request.endpoint or 'none'),))
+        record_span('render', seconds)
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (set METRICS_TOKEN to require 'Authorization: Bearer <token>')"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# ---------- slow request log ----------
+# Requests slower than SLOW_REQUEST_MS are logged as one JSON line each (to stderr, which Render
+# and gunicorn collect): route, the data file(s) served, per-phase timings, cache hits and misses
+# and response size. Records go through a QueueHandler and are written by a listener thread, so
+# logging never blocks the request thread on I/O.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+
+slow_request_log = logging.getLogger('cfa.slow_requests')
+slow_request_log.setLevel(logging.INFO)
+slow_request_log.propagate = False
+_slow_log_listener = None
+_slow_log_pid = None
+_slow_log_lock = threading.Lock()
+
+def _slow_log_handler():
+    """
+    Start the writer thread on first use in this process. A listener started before a fork (e.g.
+    by warmup under gunicorn --preload) does not exist in the child, so each process starts its own.
+    """
+    global _slow_log_listener, _slow_log_pid
+    with _slow_log_lock:
+        if _slow_log_pid != os.getpid():
+            for handler in list(slow_request_log.handlers):
+                slow_request_log.removeHandler(handler)
+            log_queue = queue.SimpleQueue()
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(logging.Formatter('%(message)s'))
+            _slow_log_listener = logging.handlers.QueueListener(log_queue, stream)
+            _slow_log_listener.start()
+            slow_request_log.addHandler(logging.handlers.QueueHandler(log_queue))
+            atexit.register(_slow_log_listener.stop)
+            _slow_log_pid = os.getpid()
+
+def note_data_file(path, size, question_count):
+    """Remember a data file served by the current request, for the slow request log"""
+    if has_request_context() and 'metrics_start' in g and path not in g.data_files:
+        g.data_files[path] = (size, question_count)
+
+def note_quiz_file(name, path, question_count):
+    """Remember the quiz file the current request resolved (path is None for decks), for the slow request log"""
+    if has_request_context() and 'metrics_start' in g and g.quiz_file is None:
+        g.quiz_file = (name, path and os.path.abspath(path), question_count)
+
+@app.after_request
+def _log_slow_request(response):
+    elapsed = time.perf_counter() - g.metrics_start
+    if elapsed * 1000 < SLOW_REQUEST_MS:
+        return response
+    # The file the view resolved, not just the first one a helper happened to load
+    name, path, question_count = g.quiz_file or (None, None, None)
+    size = g.data_files.get(path, (None, None))[0] if path else None
+    record = {
+        'event': 'slow_request',
+        'time': datetime.now().isoformat(timespec='milliseconds'),
+        'pid': os.getpid(),
+        'method': request.method,
+        'route': _metric_route(),
+        'path': request.path,
+        'status': response.status_code,
+        'user_id': session.get('user_id'),
+        'duration_ms': round(elapsed * 1000, 2),
+        'spans_ms': {phase: round(seconds * 1000, 2) for phase, seconds in g.spans.items()},
+        'data_file': name,
+        'file_bytes': size,
+        'questions': question_count,
+        'files_loaded': len(g.data_files),
+        'cache': g.cache_lookups,
+        'response_bytes': None if response.is_streamed else response.content_length,
+    }
+    _slow_log_handler()
+    slow_request_log.info(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+    return response
+
+# ---------- request profiling ----------
+# An admin can append ?_profile=1 to any URL to run that request under cProfile while a sampler
+# thread records the request thread's wall-clock stack every few milliseconds. The samples are
+# attributed to source lines, including Jinja template lines, which cProfile's per-function
+# totals cannot show. Profiles are written under STORE_FOLDER so every worker can serve them.
+PROFILE_FOLDER = os.path.join(STORE_FOLDER, 'profiles')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_KEEP = 50
+PROFILE_TOP_ENTRIES = 40
+PROFILE_ID_RE = re.compile(r'^\d+-\d+$')
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'filename')
+
+# One profiled request at a time per process: the profiler hooks are interpreter-wide on newer
+# Pythons, and overlapping samplers would skew each other's timings
+_profile_lock = threading.Lock()
+# Sampled stacks start at Flask's dispatch; the WSGI server frames above it are the same every time
+_PROFILE_ROOT_CODE = Flask.full_dispatch_request.__code__
+
+def _frame_label(frame):
+    """'file:line function' for a frame; compiled Jinja templates are mapped back to the template source line"""
+    code = frame.f_code
+    template = frame.f_globals.get('__jinja_template__')
+    if template is not None:
+        lineno = template.get_corresponding_lineno(frame.f_lineno)
+        return f'template {template.name or "<string>"}:{lineno} {code.co_name}'
+    filename = code.co_filename
+    if filename.startswith(BASE_DIR + os.sep):
+        filename = os.path.relpath(filename, BASE_DIR)
+    elif 'site-packages' + os.sep in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    return f'{filename}:{frame.f_lineno} {code.co_name}'
+
+class StackSampler(threading.Thread):
+    """Samples one thread's stack at a fixed interval into folded-stack counts (root first)"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # The sampler needs the GIL to take a sample, so ask the request thread to hand it over
+        # at least as often as we sample
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval / 5))
+        try:
+            while not self._stop_event.wait(self.interval):
+                self._sample()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            if frame.f_code is _PROFILE_ROOT_CODE:
+                break
+            frame = frame.f_back
+        if labels:
+            stack = ';'.join(reversed(labels))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _line_totals(stacks):
+    """(self, inclusive) sample counts per frame label, hottest first"""
+    own, inclusive = {}, {}
+    for stack, count in stacks.items():
+        labels = stack.split(';')
+        own[labels[-1]] = own.get(labels[-1], 0) + count
+        for label in set(labels):
+            inclusive[label] = inclusive.get(label, 0) + count
+    top = lambda totals: sorted(totals.items(), key=lambda item: -item[1])[:PROFILE_TOP_ENTRIES]
+    return top(own), top(inclusive)
+
+def _profile_path(profile_id, suffix):
+    return os.path.join(PROFILE_FOLDER, profile_id + suffix)
+
+def _prune_profiles():
+    names = sorted((n for n in os.listdir(PROFILE_FOLDER) if n.endswith('.json')),
+                   key=lambda n: int(n.split('-')[0]))
+    for name in names[:-PROFILE_KEEP]:
+        for suffix in ('.json', '.pstats'):
+            try:
+                os.remove(_profile_path(name[:-5], suffix))
+            except OSError:
+                pass
+
+def save_profile(profiler, sampler, response, elapsed):
+    """Write the pstats dump and a JSON summary for the profiled request; returns the profile id"""
+    os.makedirs(PROFILE_FOLDER, exist_ok=True)
+    profile_id = f'{int(time.time() * 1000)}-{os.getpid()}'
+    profiler.dump_stats(_profile_path(profile_id, '.pstats'))
+    own, inclusive = _line_totals(sampler.stacks)
+    summary = {
+        'id': profile_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'user_id': session.get('user_id'),
+        'method': request.method,
+        'path': request.path,
+        'query': {k: v for k, v in request.args.items() if k != '_profile'},
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 2),
+        'sample_interval_ms': sampler.interval * 1000,
+        'samples': sampler.samples,
+        'hot_lines': own,
+        'hot_lines_inclusive': inclusive,
+        'stacks': sorted(sampler.stacks.items(), key=lambda item: -item[1]),
+    }
+    with open(_profile_path(profile_id, '.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f)
+    _prune_profiles()
+    return profile_id
+
+def load_profile_summary(profile_id):
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    try:
+        with open(_profile_path(profile_id, '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+@app.before_request
+def _start_profile():
+    if request.args.get('_profile') != '1' or not session_is_admin():
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return  # another profile is running in this worker; serve the request normally
+    g.profile_start = time.perf_counter()
+    g.profile_sampler = StackSampler(threading.get_ident())
+    g.profile_sampler.start()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+def _stop_profile():
+    g.profiler.disable()
+    g.profile_sampler.stop()
+    _profile_lock.release()
+    return g.pop('profiler'), g.pop('profile_sampler'), time.perf_counter() - g.pop('profile_start')
+
+@app.after_request
+def _finish_profile(response):
+    if 'profiler' not in g:
+        return response
+    profiler, sampler, elapsed = _stop_profile()
+    try:
+        profile_id = save_profile(profiler, sampler, response, elapsed)
+    except OSError as e:
+        print(f"Error saving profile: {e}")
+        return response
+    response.headers['X-Profile'] = url_for('profile_view', profile_id=profile_id)
+    return response
+
+@app.teardown_request
+def _abandon_profile(exc):
+    if 'profiler' in g:  # the view raised before after_request could stop the profiler
+        _stop_profile()
+
+@app.route("/admin/profiles")
+@admin_required
+def profile_list():
+    """Recent request profiles from every worker, newest first"""
+    profiles = []
+    if os.path.isdir(PROFILE_FOLDER):
+        for name in os.listdir(PROFILE_FOLDER):
+            if name.endswith('.json'):
+                summary = load_profile_summary(name[:-5])
+                if summary is not None:
+                    profiles.append({k: summary[k] for k in ('id', 'created', 'user_id', 'method', 'path',
+                                                             'endpoint', 'status', 'duration_ms', 'samples')})
+    profiles.sort(key=lambda p: int(p['id'].split('-')[0]), reverse=True)
+    return jsonify({'profiles': profiles})
+
+@app.route("/admin/profiles/<profile_id>")
+@admin_required
+def profile_view(profile_id):
+    """
+    A stored profile as a text table: cProfile functions sorted by ?sort= (cumulative, tottime,
+    ncalls or filename; ?limit= rows), then the hottest sampled lines and stacks
+    """
+    summary = load_profile_summary(profile_id)
+    if summary is None:
+        return jsonify({"error": "profile not found", "id": profile_id}), 404
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in PROFILE_SORT_KEYS:
+        return jsonify({"error": f"sort must be one of {', '.join(PROFILE_SORT_KEYS)}"}), 400
+    try:
+        limit = max(1, int(request.args.get('limit', PROFILE_TOP_ENTRIES)))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    out = io.StringIO()
+    query = '&'.join(f'{k}={v}' for k, v in summary['query'].items())
+    out.write(f"{summary['method']} {summary['path']}{'?' + query if query else ''} -> {summary['status']}"
+              f"  ({summary['endpoint']}, user {summary['user_id']}, {summary['created']})\n")
+    out.write(f"{summary['duration_ms']} ms wall clock, {summary['samples']} stack samples "
+              f"every {summary['sample_interval_ms']:g} ms\n\n")
+    stats = pstats.Stats(_profile_path(profile_id, '.pstats'), stream=out)
+    stats.sort_stats(sort).print_stats(limit)
+
+    samples = summary['samples'] or 1
+    for title, rows in (('Sampled lines (self)', summary['hot_lines']),
+                        ('Sampled lines (inclusive)', summary['hot_lines_inclusive'])):
+        out.write(f'\n{title}\n')
+        for label, count in rows[:limit]:
+            out.write(f'{count:8d} {100 * count / samples:6.1f}%  {label}\n')
+    out.write('\nSampled stacks (root first)\n')
+    for stack, count in summary['stacks'][:limit]:
+        out.write(f'{count:8d} {100 * count / samples:6.1f}%  {stack}\n')
+    return app.response_class(out.getvalue(), mimetype='text/plain')
+
+@app.route("/admin/profiles/<profile_id>.pstats")
+@admin_required
+def profile_download(profile_id):
+    """The raw cProfile dump, for snakeviz or python -m pstats"""
+    if load_profile_summary(profile_id) is None:
+        return jsonify({"error": "profile not found", "id": profile_id}), 404
+    return send_file(_profile_path(profile_id, '.pstats'), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'profile-{profile_id}.pstats')
+
+# ---------- memory introspection ----------
+# /admin/memory reports what this worker holds: process RSS, the estimated deep size of every
+# in-process cache and, while tracemalloc is running, the top allocation sites and the growth
+# since a baseline snapshot. Each gunicorn worker answers for itself (see 'pid').
+MEMORY_TOP_DEFAULT = 25
+MEMORY_GROUPINGS = ('lineno', 'filename', 'traceback')
+_memory_baseline = None
+_memory_lock = threading.Lock()
+
+def deep_sizeof(obj, seen=None):
+    """
+    Estimated bytes reachable from obj: containers, strings and NumPy buffers. Objects already in
+    seen are not counted again, so sharing one set across structures avoids double counting.
+    Memory-mapped arrays count only their headers; the mapped file is reported separately.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, np.ndarray):
+            if o.base is not None and not isinstance(o, np.memmap):
+                stack.append(o.base)  # a view: the buffer belongs to its base
+    return total
+
+def _process_memory():
+    """Current and peak resident set size of this process in bytes, where the platform reports them"""
+    memory = {'rss_bytes': None, 'peak_rss_bytes': None}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory['rss_bytes'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024  # macOS reports bytes
+    return memory
+
+def cache_sizes():
+    """Entry counts and estimated deep sizes of the in-process caches, largest first"""
+    seen = set()  # shared, so objects referenced from several caches count once (under the first)
+    with _question_cache_lock:
+        question_entries = dict(_question_cache)
+    per_file = sorted((
+        {'file': os.path.basename(path), 'questions': len(entry[1]), 'bytes': deep_sizeof(entry, seen)}
+        for path, entry in question_entries.items()
+    ), key=lambda f: -f['bytes'])
+
+    structures = [
+        ('question_cache', 'normalized questions and delivery metadata per data file',
+         len(question_entries), sum(f['bytes'] for f in per_file)),
+    ]
+    for name, description, obj in (
+        ('answer_keys', 'compiled NumPy answer keys per data file', _answer_key_cache),
+        ('file_ordinals', 'global question ordinals per data file', _file_ordinals_cache),
+        ('ordinal_index', 'item id to global ordinal map', _ordinal_by_item),
+        ('corpus_index', 'ordinal to file/position index and category pools', _corpus_index),
+        ('deck_keys', 'answer keys compiled for decks', _deck_key_cache),
+        ('category_totals', 'questions per category across the corpus', _category_totals_cache),
+        ('review_schedules', 'spaced-repetition schedules of recently active users', _schedules),
+        ('autosave_pending', 'in-progress quiz snapshots waiting for the flusher', _autosave_pending),
+        ('metric_shards', 'per-thread metric counters and histograms', _metric_shards),
+    ):
+        structures.append((name, description, len(obj), deep_sizeof(obj, seen)))
+
+    plan_info = _shuffle_plan.cache_info()
+    plan_bytes = 0
+    if plan_info.currsize and question_entries:
+        # lru_cache entries are not enumerable: scale one representative plan by the entry count
+        path, entry = next(iter(question_entries.items()))
+        plan_bytes = deep_sizeof(_shuffle_plan.__wrapped__(path, entry[2], '')) * plan_info.currsize
+    structures.append(('shuffle_plans', f'per-user shuffle plans (lru_cache, max {plan_info.maxsize}; estimated)',
+                       plan_info.currsize, plan_bytes))
+
+    caches = sorted(({'name': name, 'description': description, 'entries': entries, 'bytes': size}
+                     for name, description, entries, size in structures), key=lambda c: -c['bytes'])
+    return {
+        'caches': caches,
+        'total_bytes': sum(c['bytes'] for c in caches),
+        'question_cache_files': per_file,
+        'mapped_files': {'question_stats': int(_stats_array.nbytes) if _stats_array is not None else 0},
+    }
+
+def _trace_stat(stat):
+    frame = stat.traceback[-1]  # frames run oldest first; the site is where the allocation happened
+    entry = {'site': f'{frame.filename}:{frame.lineno}', 'bytes': stat.size, 'count': stat.count}
+    if hasattr(stat, 'size_diff'):
+        entry.update(bytes_diff=stat.size_diff, count_diff=stat.count_diff)
+    if len(stat.traceback) > 1:
+        entry['traceback'] = [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+    return entry
+
+def tracemalloc_report(group_by='lineno', top=MEMORY_TOP_DEFAULT):
+    """Top allocation sites now, and the biggest changes since the baseline snapshot"""
+    report = {'tracing': tracemalloc.is_tracing()}
+    if not report['tracing']:
+        return report
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+    report.update(traced_bytes=current, traced_peak_bytes=peak,
+                  top=[_trace_stat(s) for s in snapshot.statistics(group_by)[:top]])
+    with _memory_lock:
+        baseline = _memory_baseline
+    if baseline is not None:
+        diff = snapshot.compare_to(baseline['snapshot'], group_by)
+        report['baseline'] = baseline['taken']
+        report['diff'] = [_trace_stat(s) for s in diff[:top]]
+    return report
+
+@app.route("/admin/memory")
+@admin_required
+def memory_report():
+    """
+    This worker's memory: RSS, cache sizes and, while tracing, allocation sites
+    (?group=lineno|filename|traceback, ?top=N)
+    """
+    group_by = request.args.get('group', 'lineno')
+    if group_by not in MEMORY_GROUPINGS:
+        return jsonify({"error": f"group must be one of {', '.join(MEMORY_GROUPINGS)}"}), 400
+    try:
+        top = max(1, int(request.args.get('top', MEMORY_TOP_DEFAULT)))
+    except ValueError:
+        return jsonify({"error": "top must be an integer"}), 400
+    report = {'pid': os.getpid(), 'process': _process_memory()}
+    report.update(cache_sizes())
+    report['tracemalloc'] = tracemalloc_report(group_by, top)
+    return jsonify(report)
+
+@app.route("/admin/memory/tracemalloc", methods=["POST"])
+@admin_required
+def memory_tracemalloc():
+    """
+    Control tracemalloc in this worker. action: start (optional frames, default 1), snapshot
+    (take a new baseline for diffs) or stop. Starting also takes a baseline.
+    """
+    global _memory_baseline
+    data = request.get_json(silent=True) or request.form
+    action = data.get('action')
+    if action == 'start':
+        try:
+            frames = min(max(int(data.get('frames', 1)), 1), 50)
+        except (TypeError, ValueError):
+            return jsonify({"error": "frames must be an integer"}), 400
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(frames)
+    elif action == 'stop':
+        tracemalloc.stop()
+        with _memory_lock:
+            _memory_baseline = None
+        return jsonify({'pid': os.getpid(), 'tracing': False})
+    elif action != 'snapshot':
+        return jsonify({"error": "action must be start, snapshot or stop"}), 400
+    if not tracemalloc.is_tracing():
+        return jsonify({"error": "tracemalloc is not running; start it first"}), 409
+    with _memory_lock:
+        _memory_baseline = {'snapshot': tracemalloc.take_snapshot(),
+                            'taken': datetime.now().isoformat(timespec='seconds')}
+    return jsonify({'pid': os.getpid(), 'tracing': True, 'frames': tracemalloc.get_traceback_limit(),
+                    'baseline': _memory_baseline['taken']})
+
+# ---------- template cache ----------
+# Flask's render_template_string compiles its source on every call, which for the large page
+# templates below costs more than rendering them. This environment keeps the compiled template
+# per source string, so each page template is compiled once per worker.
+TEMPLATE_CACHE_SIZE = 32
+
+class CachedStringEnvironment(FlaskEnvironment):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.string_templates = {}
+        self.string_templates_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
+        template = self.string_templates.get(source)
+        if template is None:
+            with timing_span('compile'):
+                template = super().from_string(source)
+            with self.string_templates_lock:
+                if len(self.string_templates) >= TEMPLATE_CACHE_SIZE:
+                    self.string_templates.pop(next(iter(self.string_templates)))
+                self.string_templates[source] = template
+        return template
+
+app.jinja_environment = CachedStringEnvironment
+
+# ---------- question cache ----------
+# Normalized questions per data file, shared by every request in this worker. Entries are
+# keyed by absolute path and revalidated against the file's mtime and size on each lookup,
+# so edited or re-uploaded files are picked up without a restart.
+_question_cache = {}
+_question_cache_lock = threading.Lock()
+
+def get_cached_questions(path):
+    """
+    Return (questions, content_version) for a data file, normalizing it only when it changed.
+    content_version is a short hash of the file bytes; stored attempts keep it so a review can
+    tell whether the file was edited since. The returned list is shared: treat it as read-only.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = _question_cache.get(path)
+    if entry is not None and entry[0] == stamp:
+        count_cache_lookup('questions', True)
+        note_data_file(path, st.st_size, len(entry[1]))
+        return entry[1], entry[2]
+    count_cache_lookup('questions', False)
+
+    with timing_span('load'):
+        with open(path, "rb") as f:
+            data = f.read()
+        version = hashlib.sha1(data).hexdigest()[:12]
+    parse_start = time.perf_counter()
+    raw = json.loads(data.decode("utf-8"))
+    parse_seconds = time.perf_counter() - parse_start
+    observe_metric('cfa_json_parse_seconds', parse_seconds)
+    record_span('parse', parse_seconds)
+    with timing_span('normalize'):
+        questions = normalize_questions(raw)
+        # Kept alongside so shuffled delivery never has to reparse the file
+        metadata = delivery_metadata(raw, questions)
+
+    with _question_cache_lock:
+        _question_cache[path] = (stamp, questions, version, metadata)
+    note_data_file(path, st.st_size, len(questions))
+    return questions, version
+
+# ---------- grading ----------
+# Scoring used by the quiz pages: 5 marks per correct answer, 0 for wrong or skipped
+MARKS_PER_CORRECT = 5
+
+# Categories used for score breakdowns; mock questions without a recognizable topic tag are 'Unclassified'
+GRADING_CATEGORIES = list(MODULE_CATEGORIES) + ['Unclassified']
+
+# Topic tags found in mock exam item titles, e.g. ITEM_CFA-MC-2021.05-FI-Kashyap-01
+MOCK_TOPIC_TAGS = {
+    'Ethics': 'Ethical and Professional Standards',
+    'Quant': 'Quantitative Methods',
+    'Econ': 'Economics',
+    'CorpIssuer': 'Corporate Issuers',
+    'CorpIssuers': 'Corporate Issuers',
+    'CorpFin': 'Corporate Issuers',
+    'FRA': 'Financial Statement Analysis',
+    'FSA': 'Financial Statement Analysis',
+    'FSAN': 'Financial Statement Analysis',
+    'Equity': 'Equity',
+    'FI': 'Fixed Income',
+    'Deriv': 'Derivatives',
+    'Derivs': 'Derivatives',
+    'Alt': 'Alternative Investments',
+    'Alts': 'Alternative Investments',
+    'PM': 'Portfolio Management',
+}
+# Tags are separated by dashes, or by spaces in older items (ITEM_2019B FRA 12AML)
+MOCK_TOPIC_RE = re.compile(r'[-\s](' + '|'.join(sorted(MOCK_TOPIC_TAGS, key=len, reverse=True)) + r')[-\s]')
+
+def question_category(file_name, question):
+    """Curriculum category of a question: from the module number, or the topic tag of a mock item"""
+    module_num = get_module_number(file_name)
+    if module_num:
+        category = get_module_category(module_num)
+        return category if category in MODULE_CATEGORIES else 'Unclassified'
+    match = MOCK_TOPIC_RE.search(question.get('title') or '')
+    return MOCK_TOPIC_TAGS[match.group(1)] if match else 'Unclassified'
+
+def question_categories(file_name, questions):
+    """
+    question_category() of every question in a file. Mock items without a topic tag (most
+    ITEM_CFA-L1-<number> items) are classified from their text by topic_model(), among the topics
+    the tagged items of the same session cover.
+    """
+    categories = [question_category(file_name, q) for q in questions]
+    untagged = [i for i, c in enumerate(categories) if c == 'Unclassified']
+    if untagged and not get_module_number(file_name):
+        covered = {c for c in categories if c != 'Unclassified'}
+        for i in untagged:
+            categories[i] = classify_topic(questions[i], covered)
+    return categories
+
+# ---------- topic model ----------
+# Multinomial naive Bayes over the words of a question (stem, choices and feedback), trained on the
+# module questions, whose category follows from the module number.
+TOPIC_TOKEN_RE = re.compile(r'[a-z]{3,}')
+TOPIC_MARKUP_RE = re.compile(r'<[^>]+>|&\w+;')
+_topic_model = {}
+_topic_model_lock = threading.Lock()
+
+def _topic_tokens(question):
+    parts = [question.get('stem') or ''] + [c.get('text') or '' for c in question.get('choices') or []]
+    feedback = question.get('feedback')
+    if isinstance(feedback, dict):
+        parts += [v for v in feedback.values() if isinstance(v, str)]
+    return TOPIC_TOKEN_RE.findall(TOPIC_MARKUP_RE.sub(' ', ' '.join(parts)).lower())
+
+def topic_model():
+    """
+    {'vocabulary': {word: column}, 'log_prob': (categories x words) float array}, rebuilt when a
+    module file changes. Words found in a single question are left out.
+    """
+    paths = [p for p in data_file_paths() if get_module_number(os.path.basename(p))]
+    signature = tuple((p, get_cached_questions(p)[1]) for p in paths)
+    with _topic_model_lock:
+        if _topic_model.get('signature') != signature:
+            documents, labels = [], []
+            for path in paths:
+                category = question_category(os.path.basename(path), {})
+                if category == 'Unclassified':
+                    continue
+                for q in get_cached_questions(path)[0]:
+                    documents.append(_topic_tokens(q))
+                    labels.append(GRADING_CATEGORIES.index(category))
+            document_frequency = {}
+            for tokens in documents:
+                for word in set(tokens):
+                    document_frequency[word] = document_frequency.get(word, 0) + 1
+            vocabulary = {word: i for i, word in enumerate(w for w, n in document_frequency.items() if n > 1)}
+            counts = np.ones((len(GRADING_CATEGORIES), len(vocabulary)))  # Laplace smoothing
+            for tokens, label in zip(documents, labels):
+                columns = [vocabulary[w] for w in tokens if w in vocabulary]
+                np.add.at(counts[label], columns, 1)
+            _topic_model.update(signature=signature, vocabulary=vocabulary,
+                                log_prob=np.log(counts / counts.sum(axis=1, keepdims=True)))
+        return dict(_topic_model)
+
+def classify_topic(question, categories=None):
+    """Most likely curriculum category of a question, optionally limited to a set of categories"""
+    model = topic_model()
+    words = np.zeros(len(model['vocabulary']))
+    for word in _topic_tokens(question):
+        column = model['vocabulary'].get(word)
+        if column is not None:
+            words[column] += 1
+    scores = model['log_prob'] @ words
+    allowed = np.array([c in (categories or MODULE_CATEGORIES) for c in GRADING_CATEGORIES])
+    return GRADING_CATEGORIES[int(np.argmax(np.where(allowed, scores, -np.inf)))]
+
+_answer_key_cache = {}
+
+def get_answer_key(path):
+    """
+    Compiled answer key of a data file, rebuilt whenever its content version changes:
+      correct          int8 array, correct choice index per question (-1 = no key)
+      categories       int8 array, index into GRADING_CATEGORIES per question
+      category_matrix  one-hot (questions x categories) int32 matrix used for breakdowns
+    """
+    path = os.path.abspath(path)
+    questions, version = get_cached_questions(path)
+    key = _answer_key_cache.get(path)
+    if key is not None and key['version'] == version:
+        count_cache_lookup('answer_key', True)
+        return key
+    count_cache_lookup('answer_key', False)
+
+    file_name = os.path.basename(path)
+    correct = np.array([correct_choice_index(q) for q in questions], dtype=np.int8)
+    categories = np.array([GRADING_CATEGORIES.index(c) for c in question_categories(file_name, questions)], dtype=np.int8)
+    category_matrix = np.zeros((len(questions), len(GRADING_CATEGORIES)), dtype=np.int32)
+    category_matrix[np.arange(len(questions)), categories] = 1
+    key = {
+        'file': file_name,
+        'version': version,
+        'correct': correct,
+        'categories': categories,
+        'category_matrix': category_matrix,
+    }
+    _answer_key_cache[path] = key
+    return key
+
+def grade_attempts(key, answers):
+    """
+    Grade one or many attempts against a compiled key with vectorized comparisons.
+    answers is a list of answer vectors (choice index per question, -1 = unanswered); vectors are
+    padded with -1 or truncated to the key length. Returns a dict of arrays with one row per attempt.
+    """
+    n = len(key['correct'])
+    matrix = np.full((len(answers), n), -1, dtype=np.int8)
+    for row, vector in enumerate(answers):
+        vector = vector[:n]
+        matrix[row, :len(vector)] = vector
+
+    answered = matrix >= 0
+    correct = answered & (matrix == key['correct'])
+    correct_count = correct.sum(axis=1)
+    answered_count = answered.sum(axis=1)
+    return {
+        'answers': matrix,
+        'correct': correct,
+        'answered': answered,
+        'correct_count': correct_count,
+        'incorrect_count': answered_count - correct_count,
+        'unanswered_count': n - answered_count,
+        'scores': correct_count * MARKS_PER_CORRECT,
+        'category_correct': correct.astype(np.int32) @ key['category_matrix'],
+        'category_answered': answered.astype(np.int32) @ key['category_matrix'],
+    }
+
+def graded_result(key, graded, row):
+    """JSON-friendly result for one attempt graded by grade_attempts()"""
+    n = len(key['correct'])
+    max_score = n * MARKS_PER_CORRECT
+    score = int(graded['scores'][row])
+    # 1 = correct, 0 = incorrect, -1 = unanswered
+    per_question = np.where(graded['correct'][row], 1, np.where(graded['answered'][row], 0, -1))
+    category_totals = key['category_matrix'].sum(axis=0)
+    categories = {
+        name: {
+            'total': int(category_totals[i]),
+            'answered': int(graded['category_answered'][row, i]),
+            'correct': int(graded['category_correct'][row, i]),
+        }
+        for i, name in enumerate(GRADING_CATEGORIES) if category_totals[i]
+    }
+    return {
+        'score': score,
+        'max_score': max_score,
+        'percentage': round(score * 100 / max_score) if max_score else 0,
+        'total_questions': n,
+        'correct': int(graded['correct_count'][row]),
+        'incorrect': int(graded['incorrect_count'][row]),
+        'unanswered': int(graded['unanswered_count'][row]),
+        'per_question': per_question.tolist(),
+        'correct_answers': key['correct'].tolist(),
+        'categories': categories,
+    }
+
+# Upper bound on attempts graded by one /api/grade call
+MAX_GRADE_BATCH = 10000
+
+@app.route("/api/grade", methods=["POST"])
+@login_required
+def grade_api():
+    """
+    Grade attempts server-side without storing them.
+    Body: {"file": ..., "answers": [...]} for one attempt or {"file": ..., "attempts": [[...], ...]}.
+    Mock results leave out the answer key; it is only returned by /save-quiz-result once the attempt is stored.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('file'), str):
+        return jsonify({"error": "'file' is required"}), 400
+    quiz = resolve_quiz(data['file'], session['user_id'])
+    if quiz is None:
+        return jsonify({"error": "unknown quiz file"}), 404
+
+    attempts = data.get('attempts')
+    if attempts is None:
+        attempts = [data.get('answers') or []]
+    if not isinstance(attempts, list) or len(attempts) > MAX_GRADE_BATCH:
+        return jsonify({"error": f"'attempts' must be a list of at most {MAX_GRADE_BATCH} answer vectors"}), 400
+    if not all(isinstance(vector, list) and all(a is None or (type(a) is int) for a in vector) for vector in attempts):
+        return jsonify({"error": "answer vectors must contain choice indexes"}), 400
+    attempts = [[-1 if a is None else a for a in vector] for vector in attempts]
+    if any(a < -1 or a > 25 for vector in attempts for a in vector):
+        return jsonify({"error": "choice index out of range"}), 400
+
+    key = quiz['key']
+    graded = grade_attempts(key, attempts)
+    results = [graded_result(key, graded, row) for row in range(len(attempts))]
+    if quiz['is_mock']:
+        for result in results:
+            del result['correct_answers'], result['per_question']
+    return jsonify({
+        "file": key['file'],
+        "content_version": key['version'],
+        "results": results,
+    })
+
+# ---------- question ordinals ----------
+# Every question in the corpus gets a stable global ordinal keyed by its item id. The mapping
+# lives in the store, so it is identical in every worker and survives data reloads; new items
+# simply get the next free ordinal. Array-backed per-question structures are indexed by it.
+_ordinal_by_item = {}
+_ordinal_lock = threading.Lock()
+_file_ordinals_cache = {}
+
+def question_item_key(file_name, position, question):
+    """Identity used for ordinal assignment: the item id, or file and position for items without one"""
+    return str(question.get('id') or f'{file_name}#{position}')
+
+def assign_ordinals(item_keys):
+    """Return the ordinal of each item key, assigning new ordinals for keys never seen before"""
+    with _ordinal_lock:
+        if any(k not in _ordinal_by_item for k in item_keys):
+            with store_transaction() as conn:
+                # Pick up ordinals assigned by other workers before handing out new ones
+                known = dict(conn.execute('SELECT item_id, ordinal FROM question_ordinals').fetchall())
+                next_ordinal = max(known.values(), default=-1) + 1
+                new_rows = []
+                for k in dict.fromkeys(item_keys):
+                    if k not in known:
+                        known[k] = next_ordinal
+                        new_rows.append((k, next_ordinal))
+                        next_ordinal += 1
+                conn.executemany('INSERT INTO question_ordinals (item_id, ordinal) VALUES (?, ?)', new_rows)
+            _ordinal_by_item.update(known)
+        return [_ordinal_by_item[k] for k in item_keys]
+
+def get_question_ordinals(path):
+    """Global ordinals of a data file's questions (int64 array, in file order)"""
+    path = os.path.abspath(path)
+    questions, version = get_cached_questions(path)
+    entry = _file_ordinals_cache.get(path)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    file_name = os.path.basename(path)
+    ordinals = np.array(
+        assign_ordinals([question_item_key(file_name, i, q) for i, q in enumerate(questions)]),
+        dtype=np.int64
+    )
+    _file_ordinals_cache[path] = (version, ordinals)
+    return ordinals
+
+# ---------- question statistics ----------
+# Per-question counters, updated incrementally as attempts and view events come in, so difficulty
+# and distractor reports never rescan the attempt history. They are kept in a memory-mapped
+# int64 matrix (one row per global ordinal) shared by all workers through the page cache; writers
+# serialize on a lock file.
+QUESTION_STAT_FIELDS = (
+    'attempts',      # times the question was part of a graded attempt
+    'skipped',       # ... and left unanswered
+    'correct',       # ... and answered correctly
+    'time_ms',       # total time spent on the question (from view events)
+    'time_samples',  # number of view events contributing to time_ms
+    'pick_0', 'pick_1', 'pick_2', 'pick_3',  # picks per choice index
+)
+STAT = {name: i for i, name in enumerate(QUESTION_STAT_FIELDS)}
+MAX_TRACKED_CHOICES = 4
+# Rows are added in chunks so the file is not remapped for every new question
+STATS_GROWTH_ROWS = 8192
+STATS_PATH = os.path.join(STORE_FOLDER, 'question_stats.bin')
+
+_stats_array = None
+_stats_lock = threading.Lock()
+
+@contextmanager
+def _stats_write_lock():
+    """Serialize access to the statistics file across threads and worker processes"""
+    with _stats_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(STORE_FOLDER, exist_ok=True)
+        with open(STATS_PATH + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _stats_rows(min_rows):
+    """This worker's mapping of the statistics file, grown or remapped to hold min_rows rows (call under the lock)"""
+    global _stats_array
+    if _stats_array is not None and len(_stats_array) >= min_rows:
+        return _stats_array
+    row_bytes = len(QUESTION_STAT_FIELDS) * 8
+    os.makedirs(STORE_FOLDER, exist_ok=True)
+    rows = os.path.getsize(STATS_PATH) // row_bytes if os.path.exists(STATS_PATH) else 0
+    if rows < max(min_rows, 1):
+        # Another worker may already have grown the file; only extend it when it is still too small
+        rows = (max(min_rows, 1) // STATS_GROWTH_ROWS + 1) * STATS_GROWTH_ROWS
+        with open(STATS_PATH, 'ab') as f:
+            f.truncate(rows * row_bytes)
+    _stats_array = np.memmap(STATS_PATH, dtype=np.int64, mode='r+', shape=(rows, len(QUESTION_STAT_FIELDS)))
+    return _stats_array
+
+def record_attempt_stats(ordinals, answers, correct):
+    """Fold one graded attempt (answer vector and correctness per question) into the counters"""
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    answers = np.asarray(answers)
+    if not len(ordinals):
+        return
+    answered = answers >= 0
+    picked = answered & (answers < MAX_TRACKED_CHOICES)
+    with _stats_write_lock():
+        stats = _stats_rows(int(ordinals.max()) + 1)
+        np.add.at(stats[:, STAT['attempts']], ordinals, 1)
+        np.add.at(stats[:, STAT['skipped']], ordinals[~answered], 1)
+        np.add.at(stats[:, STAT['correct']], ordinals[correct], 1)
+        np.add.at(stats, (ordinals[picked], STAT['pick_0'] + answers[picked].astype(np.int64)), 1)
+
+def record_view_times(ordinals, durations_ms):
+    """Add time-on-question samples to the counters"""
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    if not len(ordinals):
+        return
+    with _stats_write_lock():
+        stats = _stats_rows(int(ordinals.max()) + 1)
+        np.add.at(stats[:, STAT['time_ms']], ordinals, np.asarray(durations_ms, dtype=np.int64))
+        np.add.at(stats[:, STAT['time_samples']], ordinals, 1)
+
+def read_question_stats(ordinals):
+    """Counter rows for the given ordinals (a copy, one row per ordinal)"""
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    with _stats_write_lock():
+        stats = _stats_rows(int(ordinals.max()) + 1 if len(ordinals) else 1)
+        return np.array(stats[ordinals])
+
+def _flush_stats():
+    if _stats_array is not None:
+        _stats_array.flush()
+
+atexit.register(_flush_stats)
+
+# A distractor picked by fewer than this share of answering students is flagged as non-functional
+NONFUNCTIONAL_DISTRACTOR_SHARE = 0.05
+
+def question_difficulty_report(path):
+    """p-values and distractor analysis for every question of a data file"""
+    questions, version = get_cached_questions(path)
+    ordinals = get_question_ordinals(path)
+    key = get_answer_key(path)
+    rows = read_question_stats(ordinals)
+
+    report = []
+    for i, (q, row) in enumerate(zip(questions, rows)):
+        attempts = int(row[STAT['attempts']])
+        answered = attempts - int(row[STAT['skipped']])
+        correct = int(row[STAT['correct']])
+        correct_idx = int(key['correct'][i])
+        choices = []
+        for j in range(min(len(q['choices']), MAX_TRACKED_CHOICES)):
+            picks = int(row[STAT['pick_0'] + j])
+            share = picks / answered if answered else 0.0
+            choices.append({
+                'label': chr(65 + j),
+                'picks': picks,
+                'share': round(share, 3),
+                'is_correct': j == correct_idx,
+                # Distractor analysis: never/rarely picked wrong answers, or ones beating the key
+                'nonfunctional': j != correct_idx and answered > 0 and share < NONFUNCTIONAL_DISTRACTOR_SHARE,
+                'beats_key': j != correct_idx and correct_idx >= 0 and picks > correct,
+            })
+        samples = int(row[STAT['time_samples']])
+        report.append({
+            'index': i,
+            'id': q['id'],
+            'ordinal': int(ordinals[i]),
+            'attempts': attempts,
+            'answered': answered,
+            'correct': correct,
+            'p_value': round(correct / answered, 3) if answered else None,
+            'skip_rate': round(1 - answered / attempts, 3) if attempts else None,
+            'avg_time_ms': int(row[STAT['time_ms']]) // samples if samples else None,
+            'choices': choices,
+        })
+    return {'file': os.path.basename(path), 'content_version': version, 'questions': report}
+
+@app.route("/admin/question-stats/<path:filename>")
+@admin_required
+def question_stats_admin(filename):
+    """Difficulty (p-value) and distractor analysis for one data file, hardest questions first with ?sort=difficulty"""
+    path = data_file_path(filename if filename.endswith('.json') else filename + '.json')
+    if path is None:
+        return jsonify({"error": "file not found or not allowed", "file": filename}), 404
+    report = question_difficulty_report(path)
+    if request.args.get('sort') == 'difficulty':
+        report['questions'].sort(key=lambda r: (r['p_value'] is None, r['p_value']))
+    return jsonify(report)
+
+# ---------- progress bitsets ----------
+# Each user's progress over the whole corpus is kept as packed bitsets indexed by global question
+# ordinal (about 560 bytes each for the current corpus). Coverage is a popcount over a file's
+# ordinals and practice filters are plain set operations on the unpacked arrays.
+BITSET_KINDS = ('seen', 'correct', 'flagged')  # correct = the latest answer to the question was correct
+
+def _unpack_bitset(blob, size):
+    """Unpack a stored bitset into a boolean array of at least size bits"""
+    bits = np.unpackbits(np.frombuffer(blob or b'', dtype=np.uint8)).astype(bool)
+    if len(bits) < size:
+        bits = np.concatenate([bits, np.zeros(size - len(bits), dtype=bool)])
+    return bits
+
+def load_bitsets(conn, user_id, size=0):
+    """All of a user's bitsets as {kind: boolean array}, padded to at least size bits"""
+    blobs = dict(conn.execute('SELECT kind, bits FROM user_bitsets WHERE user_id = ?', (user_id,)).fetchall())
+    bitsets = {kind: np.frombuffer(blobs.get(kind) or b'', dtype=np.uint8) for kind in BITSET_KINDS}
+    size = max([size] + [len(b) * 8 for b in bitsets.values()])
+    return {kind: _unpack_bitset(b.tobytes(), size) for kind, b in bitsets.items()}
+
+def store_bitsets(conn, user_id, bitsets):
+    """Write back the given {kind: boolean array} bitsets (inside a store transaction)"""
+    conn.executemany(
+        'INSERT INTO user_bitsets (user_id, kind, bits) VALUES (?, ?, ?) '
+        'ON CONFLICT (user_id, kind) DO UPDATE SET bits = excluded.bits',
+        [(user_id, kind, np.packbits(bits).tobytes()) for kind, bits in bitsets.items()]
+    )
+
+def get_user_bitsets(user_id, size=0):
+    """Read-only snapshot of a user's bitsets, padded to at least size bits"""
+    return load_bitsets(get_store(), user_id, size)
+
+def update_progress_bitsets(conn, user_id, ordinals, graded):
+    """
+    Fold one graded attempt into the user's seen/correct bitsets (inside the attempt's transaction).
+    Returns the file's seen mask before and after the attempt.
+    """
+    bitsets = load_bitsets(conn, user_id, int(ordinals.max()) + 1 if len(ordinals) else 0)
+    seen, correct = bitsets['seen'], bitsets['correct']
+    answered = graded['answered'][0]
+    previously_seen = seen[ordinals]
+    seen[ordinals[answered]] = True
+    correct[ordinals[answered]] = graded['correct'][0][answered]
+    store_bitsets(conn, user_id, {'seen': seen, 'correct': correct})
+    return previously_seen, seen[ordinals]
+
+def corpus_progress(user_id):
+    """Number of distinct questions the user has seen and currently answers correctly"""
+    bitsets = get_user_bitsets(user_id)
+    return {'seen': int(bitsets['seen'].sum()), 'correct': int((bitsets['seen'] & bitsets['correct']).sum())}
+
+# ---------- shuffled delivery ----------
+# Optional per-user shuffling (?shuffle=1) driven by the exports' own metadata: items follow
+# metadata.ordered_item_ids (limited to visible_item_ids) and are permuted with a generator seeded
+# from metadata.shuffle_seed and the user id; choices move only where the item's shuffleRules
+# allow it, locked choices stay put. A plan is a pair of compact index arrays applied on top of
+# the cached questions, and answers coming back are mapped through it to file order.
+
+# Letter labels baked into choice text ("A. 1.8%") would be wrong once the choices move
+CHOICE_LABEL_RE = re.compile(r'^(\s*(?:<p[^>]*>)?\s*)[A-Z]\.\s+')
+
+def delivery_metadata(raw, questions):
+    """Shuffle inputs of a data file: {'seed', 'order' (positions), 'choice_rules' [(position, movable choice indexes)]}"""
+    metadata = raw.get('metadata') if isinstance(raw, dict) else None
+    metadata = metadata if isinstance(metadata, dict) else {}
+    items = _find_items_structure(raw)
+    position_of = {str(q['id']): i for i, q in enumerate(questions) if q.get('id')}
+
+    visible = set(map(str, metadata.get('visible_item_ids') or position_of))
+    order = [position_of[i] for i in map(str, metadata.get('ordered_item_ids') or []) if i in position_of and i in visible]
+    listed = set(order)
+    order += [i for i in range(len(questions)) if i not in listed and str(questions[i].get('id')) in visible]
+
+    choice_rules = []
+    for i, (item, q) in enumerate(zip(items, questions)):
+        entry = item.get('entry') if isinstance(item, dict) else None
+        rules = ((((entry or {}).get('properties') or {}).get('shuffleRules') or {}).get('choices') or {})
+        if rules.get('shuffled'):
+            locked = set(map(str, rules.get('toLock') or []))
+            movable = [j for j, c in enumerate(q['choices']) if str(c['id']) not in locked]
+            if len(movable) > 1:
+                choice_rules.append((i, movable))
+    return {'seed': str(metadata.get('shuffle_seed') or ''), 'order': order, 'choice_rules': choice_rules}
+
+@lru_cache(maxsize=4096)
+def _shuffle_plan(path, version, user_id):
+    """(item_order int16: file position shown at each slot, choice_map int8: shown choice -> file choice)"""
+    questions, _ = get_cached_questions(path)
+    metadata = _question_cache[path][3]
+    seed = int.from_bytes(hashlib.sha1(f"{metadata['seed']}:{user_id}".encode()).digest()[:8], 'little')
+    rng = np.random.default_rng(seed)
+
+    order = np.asarray(metadata['order'], dtype=np.int16)
+    item_order = order[rng.permutation(len(order))]
+    width = max([len(q['choices']) for q in questions] + [1])
+    choice_map = np.tile(np.arange(width, dtype=np.int8), (len(questions), 1))
+    for position, movable in metadata['choice_rules']:
+        choice_map[position, movable] = rng.permutation(movable)
+    return item_order, choice_map
+
+def get_shuffle_plan(quiz, user_id):
+    """Shuffle plan of a data-file quiz for this user (decks are delivered as stored)"""
+    if quiz['path'] is None:
+        return None
+    return _shuffle_plan(quiz['path'], quiz['version'], user_id)
+
+def shuffled_questions(questions, plan):
+    """The questions in delivery order; only items whose choices move are copied"""
+    item_order, choice_map = plan
+    delivered = []
+    for position in item_order.tolist():
+        q = questions[position]
+        mapping = choice_map[position, :len(q['choices'])]
+        if (mapping != np.arange(len(mapping))).any():
+            choices = [dict(q['choices'][j], text=CHOICE_LABEL_RE.sub(r'\1', q['choices'][j]['text']))
+                       for j in mapping.tolist()]
+            label = next((chr(65 + k) for k, c in enumerate(choices) if c['id'] == q.get('correct')), None)
+            q = dict(q, choices=choices, correct_label=label)
+        delivered.append(q)
+    return delivered
+
+def unshuffle_answers(plan, answers, total):
+    """Map a delivered answer vector back to file order (positions not delivered stay -1)"""
+    item_order, choice_map = plan
+    canonical = [-1] * total
+    for slot, answer in enumerate(answers[:len(item_order)]):
+        position = int(item_order[slot])
+        canonical[position] = int(choice_map[position, answer]) if 0 <= answer < choice_map.shape[1] else answer
+    return canonical
+
+def shuffle_result(plan, result):
+    """A graded result with per_question and correct_answers mapped from file order to delivery order"""
+    item_order, choice_map = plan
+    per_question, correct_answers = [], []
+    for position in item_order.tolist():
+        per_question.append(result['per_question'][position])
+        correct = result['correct_answers'][position]
+        shown = np.flatnonzero(choice_map[position] == correct) if correct >= 0 else []
+        correct_answers.append(int(shown[0]) if len(shown) else correct)
+    return dict(result, per_question=per_question, correct_answers=correct_answers)
+
+def unshuffle_position(plan, slot, choice=None):
+    """File position (and file choice index) of a delivered question slot"""
+    item_order, choice_map = plan
+    position = int(item_order[slot])
+    if choice is not None and 0 <= choice < choice_map.shape[1]:
+        choice = int(choice_map[position, choice])
+    return position, choice
+
+# ---------- decks ----------
+# A deck is a stored list of question ordinals (flagged questions, wrong answers, due reviews,
+# built quizzes...) served as a virtual quiz file named deck-<id>.json. Decks resolve their
+# questions through the global id index and the normalized-question cache, and are graded,
+# autosaved and reviewed like any data file.
+DECK_FILE_RE = re.compile(r'^deck-(\d+)\.json$')
+DECK_EMPTY_MESSAGES = {
+    'flagged': 'You have not flagged any questions yet.',
+    'wrong': 'No wrong answers to review. Well done!',
+    'due': 'Nothing is due for review right now. Come back later!',
+    'built': 'No questions match these filters.',
+    'mock': 'You have already seen every question for this session.',
+}
+# Questions per page of the wrong-answer review deck
+WRONG_DECK_PAGE_SIZE = 50
+# Decks kept per (user, kind); older ones are pruned unless an attempt or autosave refers to them
+MAX_DECKS_PER_KIND = 20
+
+_corpus_index = {}
+_corpus_index_lock = threading.Lock()
+_deck_key_cache = {}
+
+def data_file_paths():
+    """Absolute paths of all quiz files in DATA_FOLDER, sorted by name"""
+    if not os.path.exists(DATA_FOLDER):
+        return []
+    return [os.path.join(DATA_FOLDER, f) for f in sorted(os.listdir(DATA_FOLDER)) if f.endswith('.json')]
+
+def data_manifest():
+    """
+    Cheap signature of the data set: DATA_VERSION, the folder's mtime and the file names. Adding,
+    removing or replacing a file (uploads are written with os.replace) changes the folder's mtime.
+    """
+    try:
+        mtime = os.stat(DATA_FOLDER).st_mtime_ns
+    except OSError:
+        return (DATA_VERSION, None, ())
+    return (DATA_VERSION, mtime, tuple(os.path.basename(p) for p in data_file_paths()))
+
+def corpus_index():
+    """
+    Global id index, rebuilt when any data file changes (never call inside a store transaction):
+      paths        data file paths
+      file_of      int32 array, index into paths per question ordinal (-1 = not in the corpus)
+      position_of  int32 array, position of the question within its file
+      category_ordinals  {category: sorted ordinals of the module questions in that category}
+    """
+    paths = data_file_paths()
+    signature = tuple((p, get_cached_questions(p)[1]) for p in paths)
+    with _corpus_index_lock:
+        if _corpus_index.get('signature') != signature:
+            file_ordinals = [get_question_ordinals(p) for p in paths]
+            size = max((int(o.max()) + 1 for o in file_ordinals if len(o)), default=0)
+            file_of = np.full(size, -1, dtype=np.int32)
+            position_of = np.full(size, -1, dtype=np.int32)
+            module_category = np.full(size, -1, dtype=np.int8)
+            for i, ordinals in enumerate(file_ordinals):
+                file_of[ordinals] = i
+                position_of[ordinals] = np.arange(len(ordinals))
+                if os.path.basename(paths[i]).startswith('Module'):
+                    module_category[ordinals] = get_answer_key(paths[i])['categories']
+            category_ordinals = {category: np.flatnonzero(module_category == c)
+                                 for c, category in enumerate(GRADING_CATEGORIES)}
+            _corpus_index.update(signature=signature, paths=paths, file_of=file_of, position_of=position_of,
+                                 category_ordinals=category_ordinals)
+        return dict(_corpus_index)
+
+def create_deck(user_id, kind, name, ordinals, is_mock=False):
+    """
+    Store a deck and return its id. An identical deck of the same kind is reused, and decks beyond
+    the newest MAX_DECKS_PER_KIND of that kind are pruned unless an attempt or autosave refers to them.
+    """
+    items = np.asarray(ordinals, dtype=np.int32).tobytes()
+    with store_transaction() as conn:
+        row = conn.execute(
+            'SELECT id FROM decks WHERE user_id = ? AND kind = ? AND name = ? AND is_mock = ? AND items = ? '
+            'ORDER BY id DESC LIMIT 1',
+            (user_id, kind, name, int(is_mock), items)
+        ).fetchone()
+        if row:
+            return row['id']
+        deck_id = conn.execute(
+            'INSERT INTO decks (user_id, kind, name, created, is_mock, items) VALUES (?, ?, ?, ?, ?, ?)',
+            (user_id, kind, name, datetime.now().isoformat(), int(is_mock), items)
+        ).lastrowid
+        stale = [r['id'] for r in conn.execute(
+            "SELECT id FROM decks WHERE user_id = ? AND kind = ? "
+            "AND 'deck-' || id || '.json' NOT IN (SELECT file FROM attempts WHERE user_id = ?) "
+            "AND 'deck-' || id || '.json' NOT IN (SELECT file FROM autosave_log WHERE user_id = ?)",
+            (user_id, kind, user_id, user_id)
+        )]
+        newest = {r['id'] for r in conn.execute(
+            'SELECT id FROM decks WHERE user_id = ? AND kind = ? ORDER BY id DESC LIMIT ?',
+            (user_id, kind, MAX_DECKS_PER_KIND)
+        )}
+        stale = [i for i in stale if i not in newest]
+        if stale:
+            conn.executemany('DELETE FROM decks WHERE id = ?', [(i,) for i in stale])
+            for i in stale:
+                _deck_key_cache.pop(i, None)
+        return deck_id
+
+def get_deck(deck_id, user_id=None):
+    """Load one deck (optionally scoped to a user)"""
+    query = 'SELECT * FROM decks WHERE id = ?'
+    params = [deck_id]
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    row = get_store().execute(query, params).fetchone()
+    if row is None:
+        return None
+    deck = dict(row)
+    deck['ordinals'] = np.frombuffer(deck['items'], dtype=np.int32).astype(np.int64)
+    return deck
+
+def load_deck(deck):
+    """Resolve a deck into a quiz (see resolve_quiz); questions no longer in the corpus are dropped"""
+    index = corpus_index()
+    ordinals = deck['ordinals']
+    ordinals = ordinals[ordinals < len(index['file_of'])]
+    ordinals = ordinals[index['file_of'][ordinals] >= 0]
+    files = index['file_of'][ordinals]
+    positions = index['position_of'][ordinals]
+
+    questions, correct, categories, versions = [], [], [], []
+    for f, pos in zip(files.tolist(), positions.tolist()):
+        path = index['paths'][f]
+        source_questions, version = get_cached_questions(path)
+        source_key = get_answer_key(path)
+        questions.append(source_questions[pos])
+        correct.append(source_key['correct'][pos])
+        categories.append(source_key['categories'][pos])
+        versions.append(version)
+
+    file_name = f"deck-{deck['id']}.json"
+    version = hashlib.sha1(ordinals.tobytes() + ''.join(versions).encode()).hexdigest()[:12]
+    cached = _deck_key_cache.get(deck['id'])
+    if cached is None or cached['version'] != version:
+        categories = np.array(categories, dtype=np.int8)
+        category_matrix = np.zeros((len(questions), len(GRADING_CATEGORIES)), dtype=np.int32)
+        category_matrix[np.arange(len(questions)), categories] = 1
+        cached = {
+            'file': file_name,
+            'version': version,
+            'correct': np.array(correct, dtype=np.int8),
+            'categories': categories,
+            'category_matrix': category_matrix,
+        }
+        _deck_key_cache[deck['id']] = cached
+    note_quiz_file(file_name, None, len(questions))
+    return {
+        'file': file_name,
+        'name': deck['name'],
+        'path': None,
+        'deck': deck,
+        'questions': questions,
+        'version': version,
+        'key': cached,
+        'ordinals': ordinals,
+        'is_mock': bool(deck['is_mock']),
+        'is_module': False,
+    }
+
+def resolve_quiz(file_name, user_id=None):
+    """
+    Everything needed to serve or grade a quiz file: a data file, or one of the user's decks.
+    Returns None when the file is unknown.
+    """
+    match = DECK_FILE_RE.match(os.path.basename(file_name))
+    if match:
+        deck = get_deck(int(match.group(1)), user_id)
+        return load_deck(deck) if deck else None
+    path = data_file_path(file_name)
+    if path is None:
+        return None
+    questions, version = get_cached_questions(path)
+    name = os.path.basename(path)
+    note_quiz_file(name, path, len(questions))
+    return {
+        'file': name,
+        'name': name[:-5],
+        'path': path,
+        'deck': None,
+        'questions': questions,
+        'version': version,
+        'key': get_answer_key(path),
+        'ordinals': get_question_ordinals(path),
+        'is_mock': 'Mock' in name,
+        'is_module': name.startswith('Module'),
+    }
+
+def render_deck(deck, **context):
+    """Render a deck with the regular quiz page (extra context, e.g. pagination, is passed through)"""
+    quiz = load_deck(deck)
+    return render_template_string(
+        TEMPLATE,
+        questions=questions_for_client(quiz['questions'], quiz['is_mock']),
+        total=len(quiz['questions']),
+        data_source=quiz['file'],
+        quiz_name=quiz['name'],
+        is_mock=quiz['is_mock'],
+        is_module=False,
+        content_version=quiz['version'],
+        user_role=session.get('user_role', 'user'),
+        empty_message=DECK_EMPTY_MESSAGES.get(deck['kind'], 'This deck has no questions.'),
+        **context
+    )
+
+@app.route("/deck/<int:deck_id>")
+@login_required
+def deck_quiz(deck_id):
+    """Serve a deck through the regular quiz page"""
+    deck = get_deck(deck_id, session['user_id'])
+    if deck is None:
+        return jsonify({"error": "deck not found"}), 404
+    return render_deck(deck)
+
+# ---------- flags ----------
+# Flagged questions live in the user's 'flagged' bitset; a toggle flips one bit in place.
+
+def set_flag(user_id, ordinal, flagged=None):
+    """Set, clear or (flagged=None) toggle the flag of one question; returns (flagged, total flagged)"""
+    byte, mask = ordinal >> 3, 0x80 >> (ordinal & 7)  # np.packbits bit order
+    with store_transaction() as conn:
+        row = conn.execute("SELECT bits FROM user_bitsets WHERE user_id = ? AND kind = 'flagged'", (user_id,)).fetchone()
+        bits = bytearray(row['bits'] if row else b'')
+        if len(bits) <= byte:
+            bits.extend(bytes(byte + 1 - len(bits)))
+        if flagged is None:
+            flagged = not bits[byte] & mask
+        bits[byte] = bits[byte] | mask if flagged else bits[byte] & ~mask
+        conn.execute(
+            "INSERT INTO user_bitsets (user_id, kind, bits) VALUES (?, 'flagged', ?) "
+            "ON CONFLICT (user_id, kind) DO UPDATE SET bits = excluded.bits",
+            (user_id, bytes(bits))
+        )
+    return flagged, int(np.unpackbits(np.frombuffer(bytes(bits), dtype=np.uint8)).sum())
+
+@app.route("/api/flags/<path:filename>")
+@login_required
+def get_flags_api(filename):
+    """Positions of the flagged questions in a quiz file"""
+    quiz = resolve_quiz(filename, session['user_id'])
+    if quiz is None:
+        return jsonify({"error": "file not found or not allowed", "file": filename}), 404
+    ordinals = quiz['ordinals']
+    flagged = get_user_bitsets(session['user_id'], int(ordinals.max()) + 1 if len(ordinals) else 0)['flagged']
+    plan = get_shuffle_plan(quiz, session['user_id']) if request.args.get('shuffled') == '1' else None
+    if plan is not None:
+        ordinals = ordinals[plan[0]]
+    positions = np.flatnonzero(flagged[ordinals])
+    return jsonify({"file": quiz['file'], "flagged": positions.tolist()})
+
+@app.route("/api/flags", methods=["POST"])
+@login_required
+def set_flag_api():
+    """Flag or unflag a question: {"file", "question": position, "flagged": true/false, omitted to toggle}"""
+    data = request.get_json(silent=True) or {}
+    quiz = resolve_quiz(str(data.get('file') or ''), session['user_id'])
+    if quiz is None:
+        return jsonify({"status": "error", "message": "unknown quiz file"}), 400
+    try:
+        position = int(data.get('question'))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "'question' must be a question index"}), 400
+    if not 0 <= position < len(quiz['ordinals']):
+        return jsonify({"status": "error", "message": "question index out of range"}), 400
+    plan = get_shuffle_plan(quiz, session['user_id']) if data.get('shuffled') else None
+    if plan is not None:
+        if position >= len(plan[0]):
+            return jsonify({"status": "error", "message": "question index out of range"}), 400
+        position, _ = unshuffle_position(plan, position)
+    flagged = data.get('flagged')
+    if flagged is not None and not isinstance(flagged, bool):
+        return jsonify({"status": "error", "message": "'flagged' must be true, false or omitted"}), 400
+    flagged, total = set_flag(session['user_id'], int(quiz['ordinals'][position]), flagged)
+    return jsonify({"status": "success", "flagged": flagged, "total_flagged": total})
+
+@app.route("/flagged")
+@login_required
+def flagged_deck():
+    """Quiz over every question the user has flagged, across all files"""
+    flagged = get_user_bitsets(session['user_id'])['flagged']
+    deck_id = create_deck(session['user_id'], 'flagged', 'Flagged Questions', np.flatnonzero(flagged))
+    return redirect(url_for('deck_quiz', deck_id=deck_id))
+
+def wrong_answer_ordinals(user_id):
+    """Ordinals of the questions whose latest answer was wrong, in corpus order"""
+    bitsets = get_user_bitsets(user_id)
+    return np.flatnonzero(bitsets['seen'] & ~bitsets['correct'])
+
+@app.route("/wrong-answers")
+@login_required
+def wrong_answers_deck():
+    """Paginated quiz over every question the user last answered incorrectly, across all files"""
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    ordinals = wrong_answer_ordinals(session['user_id'])
+    total_pages = max((len(ordinals) + WRONG_DECK_PAGE_SIZE - 1) // WRONG_DECK_PAGE_SIZE, 1)
+    page = min(page, total_pages)
+    name = 'Wrong Answers' if total_pages == 1 else f'Wrong Answers (page {page} of {total_pages})'
+    deck_id = create_deck(session['user_id'], 'wrong', name,
+                          ordinals[(page - 1) * WRONG_DECK_PAGE_SIZE:page * WRONG_DECK_PAGE_SIZE])
+    return render_deck(get_deck(deck_id), page=page, total_pages=total_pages,
+                       page_url=url_for('wrong_answers_deck'), total_items=len(ordinals))
+
+# ---------- spaced repetition ----------
+# SM-2 review scheduling. Each user's schedule is a packed record array (16 bytes per question)
+# stored in review_schedules; in memory it is paired with a heap of (due, ordinal) so the next
+# due questions are popped in O(log n). Rescheduled questions are pushed again and their old
+# heap entries are skipped lazily when they surface.
+SRS_DTYPE = np.dtype([
+    ('ordinal', '<i4'),
+    ('due', '<i4'),        # minutes since the epoch
+    ('interval', '<f4'),   # days
+    ('ease', '<u2'),       # SM-2 ease factor x 100
+    ('reps', 'u1'),        # consecutive correct reviews
+    ('lapses', 'u1'),      # times forgotten
+])
+SRS_INITIAL_EASE = 250
+SRS_MIN_EASE = 130
+# SM-2 response quality for a correct and an incorrect answer
+SRS_QUALITY_CORRECT = 4
+SRS_QUALITY_WRONG = 1
+# Questions per /practice/due session by default
+PRACTICE_DUE_DEFAULT = 20
+MAX_PRACTICE_DUE = 200
+
+_schedules = {}
+_schedule_lock = threading.Lock()
+
+def _now_minutes():
+    return int(time.time() // 60)
+
+def _load_schedule(conn, user_id):
+    """The user's schedule as stored: {'state', 'row_of', 'heap', 'updated'}"""
+    row = conn.execute('SELECT state, updated FROM review_schedules WHERE user_id = ?', (user_id,)).fetchone()
+    state = np.frombuffer(row['state'], dtype=SRS_DTYPE).copy() if row else np.zeros(0, dtype=SRS_DTYPE)
+    heap = list(zip(state['due'].tolist(), state['ordinal'].tolist()))
+    heapq.heapify(heap)
+    return {
+        'state': state,
+        'row_of': {o: i for i, o in enumerate(state['ordinal'].tolist())},
+        'heap': heap,
+        'updated': row['updated'] if row else 0,
+    }
+
+def get_schedule(user_id):
+    """This worker's copy of a user's schedule, reloaded when another worker has changed it"""
+    updated = get_store().execute('SELECT updated FROM review_schedules WHERE user_id = ?', (user_id,)).fetchone()
+    updated = updated['updated'] if updated else 0
+    with _schedule_lock:
+        schedule = _schedules.get(user_id)
+        if schedule is None or schedule['updated'] != updated:
+            schedule = _schedules[user_id] = _load_schedule(get_store(), user_id)
+        return schedule
+
+def _sm2_review(record, quality, now):
+    """Apply one SM-2 review of the given quality (0-5) to a schedule record"""
+    ease = int(record['ease'])
+    if quality < 3:
+        record['reps'] = 0
+        record['lapses'] = min(int(record['lapses']) + 1, 255)
+        interval = 1.0
+    else:
+        reps = int(record['reps']) + 1
+        record['reps'] = min(reps, 255)
+        interval = 1.0 if reps == 1 else 6.0 if reps == 2 else float(record['interval']) * ease / 100
+    penalty = 5 - quality
+    record['ease'] = max(SRS_MIN_EASE, ease + 10 - penalty * (8 + penalty * 2))
+    record['interval'] = interval
+    record['due'] = now + int(interval * 24 * 60)
+
+def update_schedule(user_id, ordinals, answered, correct):
+    """
+    Reschedule every answered question of a graded attempt. Only the affected records are touched:
+    new questions are appended to the stored array and rescheduled ones are overwritten in place.
+    The whole schedule is only reloaded when another worker changed it since this one cached it.
+    """
+    now = _now_minutes()
+    reviewed = [(int(o), bool(c)) for o, a, c in zip(ordinals, answered, correct) if a]
+    if not reviewed:
+        return
+    with _schedule_lock, store_transaction() as conn:
+        row = conn.execute('SELECT rowid, updated FROM review_schedules WHERE user_id = ?', (user_id,)).fetchone()
+        schedule = _schedules.get(user_id)
+        if schedule is None or schedule['updated'] != (row['updated'] if row else 0):
+            schedule = _load_schedule(conn, user_id)
+        state, row_of = schedule['state'], schedule['row_of']
+        stored = len(state)
+
+        new = [o for o in dict(reviewed) if o not in row_of]
+        if new:
+            added = np.zeros(len(new), dtype=SRS_DTYPE)
+            added['ordinal'] = new
+            added['ease'] = SRS_INITIAL_EASE
+            row_of.update({o: len(state) + i for i, o in enumerate(new)})
+            state = schedule['state'] = np.concatenate([state, added])
+        changed = set()
+        for ordinal, was_correct in reviewed:
+            record = state[row_of[ordinal]]
+            _sm2_review(record, SRS_QUALITY_CORRECT if was_correct else SRS_QUALITY_WRONG, now)
+            heapq.heappush(schedule['heap'], (int(record['due']), ordinal))
+            if row_of[ordinal] < stored:
+                changed.add(row_of[ordinal])
+
+        schedule['updated'] += 1
+        _store_schedule_changes(conn, user_id, row, state, stored, sorted(changed), schedule['updated'])
+        _schedules[user_id] = schedule
+
+def _store_schedule_changes(conn, user_id, row, state, stored, changed, updated):
+    """Append the records past stored to the user's schedule blob and overwrite the changed ones"""
+    if row is not None and changed and not hasattr(conn, 'blobopen'):
+        # No incremental blob I/O before Python 3.11: write the whole array
+        conn.execute('UPDATE review_schedules SET state = ?, updated = ? WHERE rowid = ?',
+                     (state.tobytes(), updated, row['rowid']))
+        return
+    conn.execute(
+        'INSERT INTO review_schedules (user_id, state, updated) VALUES (?, ?, ?) '
+        'ON CONFLICT (user_id) DO UPDATE SET state = CAST(state || excluded.state AS BLOB), '
+        'updated = excluded.updated',
+        (user_id, state[stored:].tobytes(), updated)
+    )
+    if changed:
+        with conn.blobopen('review_schedules', 'state', row['rowid']) as blob:
+            for i in changed:
+                blob.seek(i * SRS_DTYPE.itemsize)
+                blob.write(state[i:i + 1].tobytes())
+
+def next_due(user_id, n, now=None):
+    """Ordinals of up to n questions that are due, most overdue first"""
+    now = _now_minutes() if now is None else now
+    schedule = get_schedule(user_id)
+    with _schedule_lock:
+        heap, state, row_of = schedule['heap'], schedule['state'], schedule['row_of']
+        due, taken = [], set()
+        while heap and len(due) < n and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            # Entries left behind by a reschedule no longer match the record's due time (or
+            # duplicate a live entry when it landed on the same minute); they are dropped here
+            if entry[1] not in taken and int(state[row_of[entry[1]]]['due']) == entry[0]:
+                due.append(entry)
+                taken.add(entry[1])
+        for entry in due:
+            heapq.heappush(heap, entry)
+    return [ordinal for _, ordinal in due]
+
+def due_count(user_id):
+    """Number of questions currently due for review"""
+    return int((get_schedule(user_id)['state']['due'] <= _now_minutes()).sum())
+
+@app.route("/practice/due")
+@login_required
+def practice_due():
+    """Serve the next N (?n=, default 20) questions that are due for review"""
+    try:
+        n = min(max(int(request.args.get('n', PRACTICE_DUE_DEFAULT)), 1), MAX_PRACTICE_DUE)
+    except ValueError:
+        n = PRACTICE_DUE_DEFAULT
+    ordinals = next_due(session['user_id'], n)
+    deck_id = create_deck(session['user_id'], 'due', f'Due for Review ({len(ordinals)})', ordinals)
+    return render_deck(get_deck(deck_id))
+
+# ---------- quiz builder ----------
+# Ad-hoc quizzes drawn from the module pool with stratified sampling: the requested size is split
+# across categories by weight and each category is sampled without replacement, all from the
+# category -> ordinal index, so no data file is opened while building.
+
+# Topic weights of the Level I exam (midpoints of the published ranges, in percent)
+CFA_TOPIC_WEIGHTS = {
+    'Ethical and Professional Standards': 17.5,
+    'Quantitative Methods': 7.5,
+    'Economics': 7.5,
+    'Corporate Issuers': 7.5,
+    'Financial Statement Analysis': 12.5,
+    'Equity': 12.5,
+    'Fixed Income': 12.5,
+    'Derivatives': 6.5,
+    'Alternative Investments': 8.5,
+    'Portfolio Management': 10.0,
+}
+BUILD_QUIZ_DEFAULT = 30
+MAX_BUILD_QUIZ = 180
+
+def allocate_stratified(weights, available, n):
+    """Split n draws across strata in proportion to weights (largest remainder), capped by what each stratum holds"""
+    available = np.asarray(available, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64) * (available > 0)
+    alloc = np.zeros(len(available), dtype=np.int64)
+    remaining = int(min(n, available[weights > 0].sum()))
+    while remaining > 0:
+        share = weights / weights.sum() * remaining
+        take = np.minimum(np.floor(share).astype(np.int64), available - alloc)
+        # The draws lost to rounding go to the largest remainders that still have room
+        for i in np.argsort(-(share - np.floor(share)), kind='stable'):
+            if take.sum() == remaining:
+                break
+            if weights[i] > 0 and alloc[i] + take[i] < available[i]:
+                take[i] += 1
+        alloc += take
+        remaining -= int(take.sum())
+        # Exhausted strata drop out and their share is spread over the others
+        weights = weights * (alloc < available)
+    return alloc
+
+def sample_stratified(pools, weights, n, rng):
+    """Draw n ordinals from the pools (one array per stratum) in proportion to weights, shuffled"""
+    counts = allocate_stratified(weights, [len(p) for p in pools], n)
+    picked = [rng.choice(pool, size=k, replace=False) for pool, k in zip(pools, counts) if k]
+    return rng.permutation(np.concatenate(picked)) if picked else np.zeros(0, dtype=np.int64)
+
+def module_pools(categories, exclude=None):
+    """Module question ordinals per category, leaving out the ordinals set in the exclude mask"""
+    index = corpus_index()
+    keep = None
+    if exclude is not None:
+        keep = np.ones(len(index['file_of']), dtype=bool)
+        overlap = min(len(exclude), len(keep))
+        keep[:overlap] = ~exclude[:overlap]
+    pools = []
+    for category in categories:
+        pool = index['category_ordinals'].get(category, np.zeros(0, dtype=np.int64))
+        pools.append(pool if keep is None else pool[keep[pool]])
+    return pools
+
+def _parse_category_weights(spec):
+    """'Equity:2,Fixed Income' -> {category: weight} (weight 1 when omitted, names case-insensitive; raises ValueError)"""
+    names = {c.lower(): c for c in MODULE_CATEGORIES}
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, weight = part.partition(':')
+        category = names.get(name.strip().lower())
+        if category is None:
+            raise ValueError(f"unknown category: {name.strip()}")
+        try:
+            weights[category] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"invalid weight for {category}: {weight}")
+        if weights[category] < 0:
+            raise ValueError(f"invalid weight for {category}: {weight}")
+    return weights
+
+@app.route("/build-quiz")
+@login_required
+def build_quiz():
+    """
+    Ad-hoc quiz sampled across modules, e.g. /build-quiz?categories=Equity:2,Fixed Income&n=40&unseen=1&seed=7
+    Categories default to the exam topic weights; the same seed always builds the same quiz.
+    """
+    try:
+        weights = _parse_category_weights(request.args.get('categories', '')) or dict(CFA_TOPIC_WEIGHTS)
+        n = min(max(int(request.args.get('n', BUILD_QUIZ_DEFAULT)), 1), MAX_BUILD_QUIZ)
+        seed = request.args.get('seed')
+        seed = int(seed) if seed not in (None, '') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if seed is None:
+        # Pin a seed in the URL so the quiz can be rebuilt (or shared) exactly
+        args = request.args.to_dict()
+        args['seed'] = int(np.random.default_rng().integers(1, 2 ** 31))
+        return redirect(url_for('build_quiz', **args))
+
+    unseen = request.args.get('unseen') == '1'
+    exclude = get_user_bitsets(session['user_id'])['seen'] if unseen else None
+    categories = list(weights)
+    ordinals = sample_stratified(module_pools(categories, exclude), [weights[c] for c in categories],
+                                 n, np.random.default_rng(seed))
+    name = f"Custom Quiz ({len(ordinals)} questions{', unseen' if unseen else ''}, seed {seed})"
+    deck_id = create_deck(session['user_id'], 'built', name, ordinals)
+    return render_deck(get_deck(deck_id))
+
+# Topics of the two exam sessions and the number of questions per session
+MOCK_SESSION_TOPICS = {
+    1: ('Ethical and Professional Standards', 'Quantitative Methods', 'Economics',
+        'Corporate Issuers', 'Financial Statement Analysis'),
+    2: ('Equity', 'Fixed Income', 'Derivatives', 'Alternative Investments', 'Portfolio Management'),
+}
+MOCK_SESSION_QUESTIONS = 90
+
+@app.route("/generate-mock")
+@login_required
+def generate_mock():
+    """
+    Assemble a fresh mock session (?session=1 or 2, optional ?seed=) from module questions the user
+    has not seen yet, weighted like the real exam; it is served as a mock deck
+    """
+    try:
+        session_no = int(request.args.get('session', 1))
+        seed = request.args.get('seed')
+        seed = int(seed) if seed not in (None, '') else int(np.random.default_rng().integers(1, 2 ** 31))
+    except ValueError:
+        return jsonify({"error": "'session' and 'seed' must be numbers"}), 400
+    if session_no not in MOCK_SESSION_TOPICS:
+        return jsonify({"error": "'session' must be 1 or 2"}), 400
+
+    topics = MOCK_SESSION_TOPICS[session_no]
+    seen = get_user_bitsets(session['user_id'])['seen']
+    ordinals = sample_stratified(module_pools(topics, seen), [CFA_TOPIC_WEIGHTS[t] for t in topics],
+                                 MOCK_SESSION_QUESTIONS, np.random.default_rng(seed))
+    name = f"Generated Mock Session {session_no} (seed {seed})"
+    deck_id = create_deck(session['user_id'], 'mock', name, ordinals, is_mock=True)
+    # Redirect so a reload (or resuming an autosaved session) keeps this exam instead of generating another
+    return redirect(url_for('deck_quiz', deck_id=deck_id))
+
+# ---------- mastery rollups ----------
+# Per-user accuracy and coverage, one row per data file ('file' scope) and per curriculum
+# category ('category' scope). Rows are updated in the same transaction that stores an attempt,
+# so the menu reads a handful of rows instead of scanning the attempt history. Coverage counts
+# distinct questions, using the seen masks from the progress bitsets.
+
+def update_mastery_rollups(conn, user_id, file_name, key, graded, timestamp, previously_seen, seen):
+    """
+    Fold one graded attempt into the user's file and category rollups (inside the attempt's transaction).
+    Deck attempts only feed the category rollups; their data files get coverage from the bitsets.
+    """
+    answered = graded['answered'][0]
+    total = len(answered)
+    newly_seen = (seen & ~previously_seen).astype(np.int32) @ key['category_matrix']
+    percentage = round(int(graded['correct_count'][0]) / total * 100, 1) if total else 0.0
+
+    upsert = ('INSERT INTO mastery_rollups (user_id, scope, key, attempts, answered, correct, '
+              'questions_total, questions_seen, best_percentage, last_percentage, last_attempt) '
+              'VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?) '
+              'ON CONFLICT (user_id, scope, key) DO UPDATE SET '
+              'attempts = attempts + 1, answered = answered + excluded.answered, '
+              'correct = correct + excluded.correct, questions_total = excluded.questions_total, '
+              '{seen_update}, best_percentage = MAX(best_percentage, excluded.best_percentage), '
+              'last_percentage = excluded.last_percentage, last_attempt = excluded.last_attempt')
+    # A file row takes its coverage from the merged seen mask; category rows accumulate newly seen questions
+    if not DECK_FILE_RE.match(file_name):
+        conn.execute(
+            upsert.format(seen_update='questions_seen = excluded.questions_seen'),
+            (user_id, 'file', file_name, int(answered.sum()), int(graded['correct_count'][0]), total,
+             int(seen.sum()), percentage, percentage, timestamp)
+        )
+    conn.executemany(
+        upsert.format(seen_update='questions_seen = questions_seen + excluded.questions_seen'),
+        [(user_id, 'category', category, int(graded['category_answered'][0, i]),
+          int(graded['category_correct'][0, i]), None, int(newly_seen[i]), None, None, timestamp)
+         for i, category in enumerate(GRADING_CATEGORIES) if graded['category_answered'][0, i]]
+    )
+
+_category_totals_cache = {}
+
+def corpus_category_totals():
+    """Number of questions per curriculum category across all data files, rebuilt when data_manifest() changes"""
+    manifest = data_manifest()
+    if _category_totals_cache.get('manifest') != manifest:
+        keys = [get_answer_key(p) for p in data_file_paths()]
+        totals = sum((k['category_matrix'].sum(axis=0) for k in keys), np.zeros(len(GRADING_CATEGORIES), dtype=np.int64))
+        _category_totals_cache.update(manifest=manifest, totals=dict(zip(GRADING_CATEGORIES, totals.tolist())))
+    return _category_totals_cache['totals']
+
+def _rollup_summary(row, questions_total):
+    return {
+        'attempts': row['attempts'],
+        'answered': row['answered'],
+        'correct': row['correct'],
+        'accuracy': round(row['correct'] / row['answered'] * 100, 1) if row['answered'] else None,
+        'questions_seen': row['questions_seen'],
+        'questions_total': questions_total,
+        'coverage': round(row['questions_seen'] / questions_total * 100, 1) if questions_total else None,
+        'best_percentage': row['best_percentage'],
+        'last_attempt': row['last_attempt'],
+    }
+
+def file_mastery(rollup, questions_total, questions_seen, questions_correct):
+    """
+    Menu summary of a data file: attempts and accuracy from its rollup, coverage from the progress
+    bitsets (which also count questions answered through decks). None if the file was never touched.
+    """
+    if rollup is None and not questions_seen:
+        return None
+    if rollup is None:
+        rollup = {'attempts': 0, 'answered': 0, 'correct': 0, 'best_percentage': None, 'last_attempt': None,
+                  'accuracy': round(questions_correct / questions_seen * 100, 1)}
+    return dict(rollup, questions_seen=questions_seen, questions_correct=questions_correct,
+                questions_total=questions_total,
+                coverage=round(questions_seen / questions_total * 100, 1) if questions_total else None)
+
+def get_mastery(user_id):
+    """The user's rollups as ({file name: summary}, [category summaries in curriculum order])"""
+    rows = get_store().execute(
+        'SELECT scope, key, attempts, answered, correct, questions_total, questions_seen, '
+        'best_percentage, last_attempt FROM mastery_rollups WHERE user_id = ?',
+        (user_id,)
+    ).fetchall()
+    by_file = {r['key']: _rollup_summary(r, r['questions_total']) for r in rows if r['scope'] == 'file'}
+    category_rows = {r['key']: r for r in rows if r['scope'] == 'category'}
+    categories = []
+    if category_rows:
+        totals = corpus_category_totals()
+        for category in GRADING_CATEGORIES:
+            if category in category_rows:
+                summary = _rollup_summary(category_rows[category], totals.get(category, 0))
+                summary['category'] = category
+                categories.append(summary)
+    return by_file, categories
 
 # ---------- NEW ROUTES ----------
 
@@ -330,23 +2675,27 @@ def data_file_name_route(filename):
 
     # pick first existing allowed path
     chosen = None
-    for p in tried_paths:
-        if os.path.exists(p) and is_allowed_path(p):
-            chosen = os.path.abspath(p)
-            break
+    with timing_span('resolve'):
+        for p in tried_paths:
+            if os.path.exists(p) and is_allowed_path(p):
+                chosen = os.path.abspath(p)
+                break
 
     if not chosen:
         return jsonify({"error": "file not found or not allowed", "tried": tried_paths}), 404
     
     # print(chosen)
     try:
-        questions, raw = load_questions_from_file(chosen)
+        questions, content_version = get_cached_questions(chosen)
     except Exception as e:
         return jsonify({"error": "failed to parse JSON", "detail": str(e)}), 500
 
     # render the same TEMPLATE but with questions loaded from chosen file
     # Add home button to template context
-    return render_template_string(TEMPLATE, questions=questions, total=len(questions), data_source=os.path.basename(chosen), show_home=True, user_role=session.get('user_role', 'user'))
+    data_source = os.path.basename(chosen)
+    is_mock = 'Mock' in data_source
+    return render_template_string(TEMPLATE, questions=questions_for_client(questions, is_mock), total=len(questions), data_source=data_source, show_home=True, user_role=session.get('user_role', 'user'),
+                                  is_mock=is_mock, is_module=data_source.startswith('Module'), content_version=content_version)
 
 TEMPLATE = """
 <!doctype html>
@@ -439,7 +2788,14 @@ input[type="radio"]{width:18px;height:18px;margin-top:3px}
   <div class="topbar">
     <div>
       <div class="exam-title">Loaded quiz — {{ total }} questions</div>
-      <div style="color:var(--muted);font-size:13px">Source: {{ data_source }}</div>
+      <div style="color:var(--muted);font-size:13px">Source: {{ quiz_name or data_source }}</div>
+      {% if total_pages and total_pages > 1 %}
+      <div style="font-size:13px;margin-top:4px">
+        {% if page > 1 %}<a href="{{ page_url }}?page={{ page - 1 }}" style="color:var(--accent-light)">← Previous page</a>{% endif %}
+        <span style="color:var(--muted);margin:0 8px">Page {{ page }} of {{ total_pages }}{% if total_items %} · {{ total_items }} questions{% endif %}</span>
+        {% if page < total_pages %}<a href="{{ page_url }}?page={{ page + 1 }}" style="color:var(--accent-light)">Next page →</a>{% endif %}
+      </div>
+      {% endif %}
     </div>
     <div style="display:flex;gap:8px;align-items:center">
       <a href="/menu" class="btn" style="text-decoration:none;color:#0f1724">🏠 Home</a>
@@ -476,6 +2832,7 @@ input[type="radio"]{width:18px;height:18px;margin-top:3px}
             <input id="gotoInput" type="number" min="1" style="width:64px;padding:6px;border-radius:6px;border:1px solid #e6eef6;margin-left:6px"/>
             <button class="btn" id="gotoBtn" type="button">Go</button>
           </div>
+          <button type="button" class="btn" id="flag" title="Flag this question to come back to it later">🏳️ Flag</button>
           <button type="button" class="btn" id="skip">Skip</button>
           <button type="button" class="btn primary" id="submit">Submit Answer</button>
           <button type="button" class="btn primary" id="finish" style="display:none;">Finish Exam</button>
@@ -508,6 +2865,8 @@ let originalOrder = [...Array(total).keys()]; // Keep track of original order
 // Check if this is a mock exam or study module
 const isMock = {{ is_mock | tojson }};
 const isModule = {{ is_module | tojson }};
+// Shuffled delivery: positions and choices sent back are in this page's order, the server maps them
+const shuffled = {{ (shuffled or false) | tojson }};
 
 document.getElementById('qnum').textContent = idx+1 + ' / ' + total;
 
@@ -525,8 +2884,8 @@ function updateProgress() {
   document.getElementById('progressFill').style.width = progressPercent + '%';
   document.getElementById('progressText').textContent = `${answeredCount} of ${total} questions answered`;
   
-  // Show finish button when all questions are answered (mock exams only)
-  if (isMock && answeredCount === total) {
+  // Show finish button when all questions are answered (mock exams) or once practice has started (modules)
+  if ((isMock && answeredCount === total) || (!isMock && answeredCount > 0)) {
     document.getElementById('finish').style.display = 'inline-block';
   } else {
     document.getElementById('finish').style.display = 'none';
@@ -539,6 +2898,7 @@ function stripHtml(html){
 }
 
 function render(i){
+  if (i !== idx) trackView();
   idx = i;
   const q = currentQuestions[i];
   document.getElementById('qnum').textContent = (i+1) + ' / ' + total;
@@ -565,6 +2925,7 @@ function render(i){
   
   document.getElementById('feedback').innerHTML = '';
   document.getElementById('gotoInput').value = '';
+  updateFlagButton();
   
   if (userAnswers[i]) {
     const prevSelected = document.querySelector(`input[value="${userAnswers[i]}"]`);
@@ -582,6 +2943,8 @@ function submitAnswerAutomatically(choiceId) {
   userAnswers[idx] = choiceId;
   questionStatus[idx] = true;
   updateProgress();
+  queueAutosave();
+  trackEvent('a', idx, (currentQuestions[idx].choices || []).findIndex(c => c.id === choiceId));
   
   const q = currentQuestions[idx];
   const correct = q.correct || null;
@@ -592,21 +2955,30 @@ function submitAnswerAutomatically(choiceId) {
 
 
 
-function showFinalResults() {
-  // Calculate score (5 marks for correct, 0 for wrong/skipped)
-  let correctCount = 0;
-  let totalScore = 0;
-  const maxPossibleScore = total * 5;
+async function showFinalResults() {
+  clearTimeout(autosaveTimer);
+  autosaveTimer = null;
+  trackView();
+  flushEvents(false);
   
-  currentQuestions.forEach((q, i) => {
-    if (userAnswers[i] && q.correct && userAnswers[i] === q.correct) {
-      correctCount++;
-      totalScore += 5; // 5 marks for correct answer
-    }
-    // 0 marks for wrong or skipped answers
-  });
+  // Scoring happens server-side (5 marks for correct, 0 for wrong/skipped); mock pages never receive the key
+  const finishBtn = document.getElementById('finish');
+  finishBtn.disabled = true;
+  let result = null;
+  try {
+    result = await saveQuizResult();
+  } catch (err) {
+    console.error('Error saving quiz result:', err);
+  }
+  finishBtn.disabled = false;
+  if (!result) {
+    document.getElementById('feedback').innerHTML = `<div class="result wrong">Could not submit your answers. Please check your connection and try again.</div>`;
+    return;
+  }
   
-  const scorePercent = Math.round((totalScore / maxPossibleScore) * 100);
+  const totalScore = result.score;
+  const maxPossibleScore = result.max_score;
+  const scorePercent = result.percentage;
   
   // Hide quiz card and show results
   document.getElementById('card').style.display = 'none';
@@ -616,14 +2988,16 @@ function showFinalResults() {
   document.getElementById('finalScore').textContent = totalScore + '/' + maxPossibleScore;
   document.getElementById('finalMessage').textContent = `You scored ${totalScore} out of ${maxPossibleScore} marks (${scorePercent}%).`;
   
-  // Display score details
+  // Display score details (mock results leave out the answers; they are in the attempt review)
   let scoreDetails = `<div class="score-details"><h3>Question Review:</h3>`;
-  currentQuestions.forEach((q, i) => {
+  if (!result.per_question) {
+    scoreDetails += `<p>${result.correct} correct, ${result.incorrect} incorrect, ${result.unanswered} skipped. Use Review Answers to see each question with its correct answer.</p>`;
+  }
+  (result.per_question ? currentQuestions : []).forEach((q, i) => {
     const userAnswer = userAnswers[i];
-    const isCorrect = userAnswer && q.correct && userAnswer === q.correct;
+    const isCorrect = result.per_question[i] === 1;
     const statusClass = isCorrect ? 'correct' : (userAnswer ? 'incorrect' : 'skipped');
     const statusText = isCorrect ? 'Correct (+5 marks)' : (userAnswer ? 'Incorrect (0 marks)' : 'Skipped (0 marks)');
-    const statusColor = isCorrect ? 'var(--success)' : (userAnswer ? 'var(--danger)' : 'var(--muted)');
     
     // Find the text for the user's answer
     let userAnswerText = 'Not answered';
@@ -634,9 +3008,9 @@ function showFinalResults() {
     
     // Find the correct answer text
     let correctAnswerText = 'Not provided';
-    if (q.correct) {
-      const correctChoice = q.choices.find(c => c.id === q.correct);
-      correctAnswerText = correctChoice ? correctChoice.text : 'Unknown correct answer';
+    const correctChoice = (q.choices || [])[result.correct_answers[i]];
+    if (correctChoice) {
+      correctAnswerText = correctChoice.text;
     }
     
     scoreDetails += `
@@ -651,6 +3025,153 @@ function showFinalResults() {
   document.getElementById('scoreDetails').innerHTML = scoreDetails;
 }
 
+// Answer events are buffered and posted in batches: every 15s and, via sendBeacon, when the page is hidden
+const eventFile = {{ data_source | tojson }};
+let eventQueue = [];
+
+function trackEvent(t, q, c, ms) {
+  eventQueue.push({t: t, q: q, c: (c === undefined ? null : c), ms: (ms === undefined ? null : Math.round(ms)), at: Date.now()});
+  if (eventQueue.length >= 200) flushEvents(false);
+}
+
+function flushEvents(useBeacon) {
+  if (!eventQueue.length) return;
+  const body = JSON.stringify({file: eventFile, content_version: {{ content_version | tojson }}, shuffled: shuffled, events: eventQueue});
+  eventQueue = [];
+  if (useBeacon && navigator.sendBeacon && navigator.sendBeacon('/api/events', body)) return;
+  fetch('/api/events', {method: 'POST', headers: {'Content-Type': 'application/json'}, body: body, keepalive: true})
+    .catch(err => console.error('Error sending events:', err));
+}
+
+setInterval(() => flushEvents(false), 15000);
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') flushEvents(true);
+});
+window.addEventListener('pagehide', () => flushEvents(true));
+
+// Time spent on the question currently shown
+let questionShownAt = Date.now();
+
+function trackView() {
+  if (total > 0) trackEvent('v', idx, null, Date.now() - questionShownAt);
+  questionShownAt = Date.now();
+}
+
+// Compact answer vector: choice index per question, -1 = unanswered
+function answerVector() {
+  return currentQuestions.map((q, i) => userAnswers[i] ? (q.choices || []).findIndex(c => c.id === userAnswers[i]) : -1);
+}
+
+// Id of the stored attempt, for the review link on the results screen
+let attemptId = null;
+
+// Persist the finished attempt; resolves to the server-graded result
+async function saveQuizResult() {
+  const response = await fetch('/save-quiz-result', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({
+      file: {{ data_source | tojson }},
+      quiz_name: {{ (quiz_name or data_source[:-5]) | tojson }},
+      content_version: {{ content_version | tojson }},
+      shuffled: shuffled,
+      answers: answerVector(),
+      duration_seconds: Math.floor((Date.now() - start) / 1000)
+    })
+  });
+  const data = await response.json();
+  if (data.status !== 'success') return null;
+  attemptId = data.attempt_id;
+  return data.result;
+}
+
+// Autosave of in-progress mock exams: state is posted (debounced) after every answer and
+// restored on load, so a refresh or network blip does not lose the session
+// A shuffled session is saved separately from the file-order one
+const autosaveUrl = '/api/autosave/' + encodeURIComponent({{ data_source | tojson }}) + (shuffled ? '?shuffled=1' : '');
+const contentVersion = {{ content_version | tojson }};
+let autosaveTimer = null;
+
+function queueAutosave() {
+  if (!isMock) return;
+  clearTimeout(autosaveTimer);
+  autosaveTimer = setTimeout(sendAutosave, 1000);
+}
+
+function sendAutosave() {
+  autosaveTimer = null;
+  fetch(autosaveUrl, {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    keepalive: true,
+    body: JSON.stringify({
+      answers: answerVector(),
+      status: questionStatus.map(s => s ? 1 : 0),
+      current: idx,
+      elapsed_seconds: Math.floor((Date.now() - start) / 1000),
+      content_version: contentVersion
+    })
+  }).catch(err => console.error('Error autosaving:', err));
+}
+
+async function resumeAutosave() {
+  if (!isMock) return;
+  try {
+    const response = await fetch(autosaveUrl);
+    const state = (await response.json()).state;
+    // Ignore snapshots of another version of this file
+    if (!state || state.content_version !== contentVersion || state.answers.length !== total) return;
+    state.answers.forEach((a, i) => {
+      const choice = a >= 0 ? (currentQuestions[i].choices || [])[a] : null;
+      userAnswers[i] = choice ? choice.id : null;
+    });
+    state.status.forEach((s, i) => { questionStatus[i] = !!s; });
+    start = Date.now() - state.elapsed_seconds * 1000;
+    render(Math.min(Math.max(state.current, 0), total - 1));
+    updateProgress();
+    document.getElementById('feedback').innerHTML = `<div class="result info">Resumed your saved session.</div>`;
+  } catch (err) {
+    console.error('Error resuming session:', err);
+  }
+}
+
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden' && autosaveTimer) {
+    clearTimeout(autosaveTimer);
+    sendAutosave();
+  }
+});
+
+// Flagged questions (positions in this quiz); the flagged deck collects them across files
+const flagged = new Set();
+
+function updateFlagButton() {
+  document.getElementById('flag').textContent = flagged.has(idx) ? '🚩 Flagged' : '🏳️ Flag';
+}
+
+async function loadFlags() {
+  try {
+    const response = await fetch('/api/flags/' + encodeURIComponent({{ data_source | tojson }}) + (shuffled ? '?shuffled=1' : ''));
+    ((await response.json()).flagged || []).forEach(i => flagged.add(i));
+    updateFlagButton();
+  } catch (err) {
+    console.error('Error loading flags:', err);
+  }
+}
+
+document.getElementById('flag').addEventListener('click', async ()=>{
+  const i = idx;
+  const response = await fetch('/api/flags', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({file: {{ data_source | tojson }}, question: i, flagged: !flagged.has(i), shuffled: shuffled})
+  });
+  const data = await response.json();
+  if (data.status !== 'success') return;
+  if (data.flagged) flagged.add(i); else flagged.delete(i);
+  updateFlagButton();
+});
+
 document.getElementById('next').addEventListener('click', ()=>{
   if(idx < total-1) render(idx+1);
 });
@@ -662,6 +3183,8 @@ document.getElementById('skip').addEventListener('click', ()=>{
   userAnswers[idx] = null;
   questionStatus[idx] = true;
   updateProgress();
+  queueAutosave();
+  trackEvent('s', idx);
   
   if(idx < total-1) render(idx+1);
 });
@@ -676,11 +3199,18 @@ document.getElementById('submit').addEventListener('click', ()=>{
     fbDiv.innerHTML = `<div class="result wrong">Please select an option.</div>`; 
     return; 
   }
+  if (isMock) {
+    // Mock answers are graded when the exam is finished
+    submitAnswerAutomatically(sel.value);
+    return;
+  }
   
   const chosen = sel.value;
   userAnswers[idx] = chosen;
   questionStatus[idx] = true;
   updateProgress();
+  queueAutosave();
+  trackEvent('a', idx, (currentQuestions[idx].choices || []).findIndex(c => c.id === chosen));
   
   const q = currentQuestions[idx];
   const correct = q.correct || null;
@@ -759,25 +3289,24 @@ document.getElementById('submit').addEventListener('click', ()=>{
 });
 
 document.getElementById('finish').addEventListener('click', ()=>{
-  // Only for mock exams
-  if (isMock) {
-    showFinalResults();
-  }
+  showFinalResults();
 });
 
 document.getElementById('reviewAnswers').addEventListener('click', ()=>{
-  // Redirect to the all questions view
-  window.location.href = '/all-questions/' + '{{ data_source[:-5] }}'; // Remove .json extension
+  // Review of the attempt just stored (only shown once the results are in)
+  if (attemptId !== null) window.location.href = '/review-answers/' + attemptId;
 });
 
 function escapeHtml(s){ if(!s) return ''; return String(s).replace(/&/g,'&amp;').replace(/</g,'&lt;').replace(/>/g,'&gt;').replace(/\\n/g,'<br>'); }
 
 // initial render
 if(total === 0){
-  document.body.innerHTML = '<div style="padding:40px;font-family:Inter,Arial">No questions found — check data1.json.</div>';
+  document.body.innerHTML = '<div style="padding:40px;font-family:Inter,Arial">' + escapeHtml({{ (empty_message or 'No questions found — check data1.json.') | tojson }}) + ' <a href="/menu">Back to menu</a></div>';
 } else {
   render(0);
   updateProgress();
+  resumeAutosave();
+  loadFlags();
 }
 
 // Screenshot and Screen Recording Prevention for Regular Users
@@ -905,7 +3434,9 @@ def upload_data():
         return jsonify({"error": "empty filename"}), 400
     filename = secure_filename(f.filename) if f.filename else "default.json"
     dest = os.path.join(UPLOAD_FOLDER, filename)
-    f.save(dest)
+    # Write then rename, so readers never see a partial file and data_manifest() notices the change
+    f.save(dest + ".tmp")
+    os.replace(dest + ".tmp", dest)
     # return the UI URL for the uploaded file
     url = url_for("data_file_name_route", filename=os.path.join("uploads", filename))
     return jsonify({"message": "uploaded", "filename": filename, "open_url": url})
@@ -961,12 +3492,9 @@ def menu():
                     file_size = os.path.getsize(file_path)
                     size_kb = file_size / 1024
                     
-                    # Try to count questions
+                    # Count questions (from the question cache, so the files are not reparsed on every visit)
                     try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            items = _find_items_structure(data)
-                            question_count = len(items)
+                        question_count = len(get_cached_questions(file_path)[0])
                     except Exception:
                         question_count = 0
                     
@@ -991,12 +3519,23 @@ def menu():
     # Get recently viewed items
     recently_viewed_items = get_recently_viewed(session)
     
+    # Progress badges and the category summary come from the precomputed rollups and the progress bitsets
+    mastery_by_file, category_mastery = get_mastery(session['user_id'])
+    bitsets = get_user_bitsets(session['user_id'])
+    for f in files:
+        ordinals = get_question_ordinals(os.path.join(DATA_FOLDER, f['name'])) if f['questions'] else np.zeros(0, dtype=np.int64)
+        ordinals = ordinals[ordinals < len(bitsets['seen'])]
+        seen = bitsets['seen'][ordinals]
+        f['mastery'] = file_mastery(mastery_by_file.get(f['name']), f['questions'], int(seen.sum()),
+                                    int((seen & bitsets['correct'][ordinals]).sum()))
+        f['completed'] = bool(f['mastery'] and f['mastery']['questions_seen'] >= f['mastery']['questions_total'])
+    
     # Calculate file categories
     modules = [f for f in files if f['is_module']]
     mocks = [f for f in files if f['is_mock']]
     
     # Pass user role to template
-    return render_template_string(MENU_TEMPLATE, files=files, total_files=len(files), debug_modules=len(modules), debug_mocks=len(mocks), session=session, recently_viewed=recently_viewed_items, current_sort=sort_type, user_role=session.get('user_role', 'user'))
+    return render_template_string(MENU_TEMPLATE, files=files, total_files=len(files), debug_modules=len(modules), debug_mocks=len(mocks), session=session, recently_viewed=recently_viewed_items, current_sort=sort_type, user_role=session.get('user_role', 'user'), category_mastery=category_mastery, progress=corpus_progress(session['user_id']), total_questions=sum(f['questions'] for f in files), due_count=due_count(session['user_id']))
 
 
 @app.route("/recently-viewed")
@@ -1010,8 +3549,16 @@ def recently_viewed():
 @login_required
 def history():
     """Display user's quiz history"""
-    user_history = get_user_history(session)
-    return render_template_string(HISTORY_TEMPLATE, history=user_history, session=session)
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    user_id = session['user_id']
+    total_attempts = count_user_history(user_id)
+    total_pages = max((total_attempts + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
+    user_history = get_user_history(user_id, limit=HISTORY_PAGE_SIZE, offset=(page - 1) * HISTORY_PAGE_SIZE)
+    return render_template_string(HISTORY_TEMPLATE, history=user_history, session=session,
+                                  total_attempts=total_attempts, page=page, total_pages=total_pages)
 
 @app.route("/save-quiz-result", methods=["POST"])
 @login_required
@@ -1019,10 +3566,16 @@ def save_quiz_result():
     """Save quiz result to user's history"""
     try:
         # Get quiz data from request
-        quiz_data = request.get_json()
+        quiz_data = request.get_json(silent=True)
         
-        # Add to history
-        add_to_history(session, quiz_data)
+        # Grade and add to history
+        attempt_id, result = add_to_history(session['user_id'], quiz_data)
+        quiz = resolve_quiz(quiz_data['file'], session['user_id'])
+        # The quiz is finished, so there is nothing left to resume (in the mode it was taken in)
+        discard_autosave(session['user_id'], autosave_slot(quiz['file'], bool(quiz_data.get('shuffled'))))
+        if quiz['is_mock']:
+            # Only the review of the stored attempt shows a mock's answers, however often it is posted
+            result = {k: v for k, v in result.items() if k not in ('per_question', 'correct_answers')}
         
         # Also add to recently viewed
         add_to_recently_viewed(session, {
@@ -1030,10 +3583,261 @@ def save_quiz_result():
             'type': 'quiz_result'
         })
         
-        return jsonify({"status": "success"})
+        return jsonify({"status": "success", "attempt_id": attempt_id, "result": result})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/review-answers/<int:attempt_id>")
+@login_required
+def review_answers(attempt_id):
+    """Rebuild the review of a stored attempt by joining its answer vector with the cached questions"""
+    attempt = get_attempt(attempt_id, user_id=session['user_id'])
+    if attempt is None:
+        return jsonify({"error": "attempt not found"}), 404
+
+    quiz = resolve_quiz(attempt['file'], session['user_id'])
+    if quiz is None:
+        return jsonify({"error": "quiz file is no longer available", "file": attempt['file']}), 404
+    questions, content_version = quiz['questions'], quiz['version']
+
+    answers = attempt['answers']
+    review = []
+    for i, q in enumerate(questions):
+        chosen = answers[i] if i < len(answers) else -1
+        correct = correct_choice_index(q)
+        if chosen < 0:
+            status = 'skipped'
+        elif chosen == correct:
+            status = 'correct'
+        else:
+            status = 'incorrect'
+        review.append({'question': q, 'chosen': chosen, 'correct': correct, 'status': status})
+
+    # The file was edited after the attempt: answers are matched by position and may not line up
+    stale = bool(attempt['content_version']) and attempt['content_version'] != content_version
+    return render_template_string(REVIEW_TEMPLATE, attempt=attempt, review=review, stale=stale, session=session)
+
+# ---------- autosave ----------
+# Quiz pages post their state on every answer. Snapshots are held per (user, file) in memory
+# and only the latest one survives until the background flusher appends all pending snapshots
+# to autosave_log in a single transaction, so a burst of clicks costs one write per interval.
+AUTOSAVE_FLUSH_SECONDS = float(os.environ.get('AUTOSAVE_FLUSH_SECONDS', 2))
+# Compact the log every this many flushes
+AUTOSAVE_COMPACT_EVERY = int(os.environ.get('AUTOSAVE_COMPACT_EVERY', 150))
+# Discard markers are kept this long, so a stale snapshot flushed late by another worker stays superseded
+AUTOSAVE_DISCARD_KEEP_SECONDS = 3600
+
+_autosave_pending = {}
+_autosave_lock = threading.Lock()
+_autosave_thread = None
+
+def _parse_autosave_state(data):
+    """Validate a posted quiz snapshot and return its compact form (raises ValueError)"""
+    if not isinstance(data, dict):
+        raise ValueError("autosave payload must be a JSON object")
+    answers = data.get('answers')
+    status = data.get('status')
+    if not isinstance(answers, list) or not isinstance(status, list) or len(answers) != len(status):
+        raise ValueError("'answers' and 'status' must be lists of the same length")
+    if len(answers) > 1000:
+        raise ValueError("too many questions")
+    try:
+        answers = [-1 if a is None else int(a) for a in answers]
+        current = int(data.get('current') or 0)
+        elapsed = int(data.get('elapsed_seconds') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("answers, current and elapsed_seconds must be numbers")
+    if any(a < -1 or a > 25 for a in answers):
+        raise ValueError("choice index out of range")
+    return {
+        'answers': answers,
+        'status': [1 if s else 0 for s in status],
+        'current': current,
+        'elapsed_seconds': elapsed,
+        'content_version': data.get('content_version'),
+    }
+
+def queue_autosave(user_id, file_name, state):
+    """Replace the pending snapshot for (user, file); it is written on the next flush"""
+    global _autosave_thread
+    with _autosave_lock:
+        _autosave_pending[(user_id, file_name)] = (datetime.now().isoformat(), state)
+        if _autosave_thread is None:
+            # Started lazily so the gunicorn master never owns a flusher thread
+            _autosave_thread = threading.Thread(target=_autosave_loop, name='autosave-flusher', daemon=True)
+            _autosave_thread.start()
+
+def autosave_slot(file_name, shuffled=False):
+    """Autosave key of a quiz file: its shuffled and file-order sessions are saved separately"""
+    return file_name + '#shuffled' if shuffled else file_name
+
+def discard_autosave(user_id, file_name):
+    """Forget an in-progress session (after it was finished or restarted)"""
+    queue_autosave(user_id, file_name, None)
+
+def flush_autosave():
+    """Append every pending snapshot to the log in one transaction"""
+    with _autosave_lock:
+        if not _autosave_pending:
+            return 0
+        batch = list(_autosave_pending.items())
+        _autosave_pending.clear()
+    with store_transaction() as conn:
+        conn.executemany(
+            'INSERT INTO autosave_log (user_id, file, timestamp, state) VALUES (?, ?, ?, ?)',
+            [(user_id, file_name, ts, None if state is None else json.dumps(state, separators=(',', ':')))
+             for (user_id, file_name), (ts, state) in batch]
+        )
+    return len(batch)
+
+def compact_autosave():
+    """Drop every log row that has been superseded by a newer one for the same session"""
+    cutoff = datetime.fromtimestamp(time.time() - AUTOSAVE_DISCARD_KEEP_SECONDS).isoformat()
+    with store_transaction() as conn:
+        conn.execute(
+            'DELETE FROM autosave_log WHERE id NOT IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER '
+            '(PARTITION BY user_id, file ORDER BY timestamp DESC, id DESC) AS newest FROM autosave_log) '
+            'WHERE newest = 1)'
+        )
+        conn.execute('DELETE FROM autosave_log WHERE state IS NULL AND timestamp < ?', (cutoff,))
+
+def _autosave_loop():
+    flushes = 0
+    while True:
+        time.sleep(AUTOSAVE_FLUSH_SECONDS)
+        try:
+            if flush_autosave():
+                flushes += 1
+                if flushes % AUTOSAVE_COMPACT_EVERY == 0:
+                    compact_autosave()
+        except Exception as e:
+            print(f"Autosave flush failed: {e}")
+
+atexit.register(flush_autosave)
+
+def load_autosave(user_id, file_name):
+    """Latest snapshot for (user, file) by queue time, from this worker's pending buffer or the log"""
+    with _autosave_lock:
+        pending = _autosave_pending.get((user_id, file_name))
+    row = get_store().execute(
+        'SELECT timestamp, state FROM autosave_log WHERE user_id = ? AND file = ? '
+        'ORDER BY timestamp DESC, id DESC LIMIT 1',
+        (user_id, file_name)
+    ).fetchone()
+    if pending is not None and (row is None or pending[0] >= row['timestamp']):
+        return pending[1]
+    if row is None or row['state'] is None:
+        return None
+    return json.loads(row['state'])
+
+@app.route("/api/autosave/<path:filename>", methods=["GET", "POST", "DELETE"])
+@login_required
+def autosave_api(filename):
+    """
+    Save (POST), resume (GET) or discard (DELETE) the in-progress state of a quiz file;
+    ?shuffled=1 addresses the session of its shuffled page.
+    """
+    user_id = session['user_id']
+    quiz = resolve_quiz(filename, user_id)
+    if quiz is None:
+        return jsonify({"status": "error", "message": "unknown quiz file"}), 404
+    shuffled = request.args.get('shuffled') == '1'
+    slot = autosave_slot(quiz['file'], shuffled)
+    if request.method == "POST":
+        try:
+            state = _parse_autosave_state(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        queue_autosave(user_id, slot, state)
+        return jsonify({"status": "queued"})
+    if request.method == "DELETE":
+        discard_autosave(user_id, slot)
+        return jsonify({"status": "discarded"})
+    return jsonify({"file": quiz['file'], "shuffled": shuffled, "state": load_autosave(user_id, slot)})
+
+# ---------- answer events ----------
+# Quiz pages buffer per-question events and post them in batches (periodically and via
+# navigator.sendBeacon when the page is hidden). A batch is {"file", "content_version",
+# "events": [{"t": type, "q": question, "c": choice, "ms": duration, "at": client time}]}.
+EVENT_TYPES = {
+    'a': 'answer',  # choice c picked for question q
+    's': 'skip',    # question q skipped
+    'v': 'view',    # ms spent on question q before moving away
+}
+MAX_EVENTS_PER_BATCH = 500
+
+def _parse_event_batch(data):
+    """Validate an event batch and return (file, content_version, rows) (raises ValueError)"""
+    if not isinstance(data, dict):
+        raise ValueError("event batch must be a JSON object")
+    file_name = data.get('file')
+    if not isinstance(file_name, str) or not file_name:
+        raise ValueError("'file' is required")
+    events = data.get('events')
+    if not isinstance(events, list) or not events:
+        raise ValueError("'events' must be a non-empty list")
+    if len(events) > MAX_EVENTS_PER_BATCH:
+        raise ValueError(f"at most {MAX_EVENTS_PER_BATCH} events per batch")
+
+    rows = []
+    for ev in events:
+        if not isinstance(ev, dict) or ev.get('t') not in EVENT_TYPES:
+            raise ValueError("unknown event type")
+        try:
+            question = int(ev['q'])
+            choice = int(ev['c']) if ev.get('c') is not None else None
+            duration = int(ev['ms']) if ev.get('ms') is not None else None
+            client_ts = int(ev['at']) if ev.get('at') is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("event fields q, c, ms and at must be numbers")
+        if not 0 <= question < 1000 or (choice is not None and not -1 <= choice <= 25):
+            raise ValueError("question or choice index out of range")
+        if duration is not None and not 0 <= duration <= 24 * 3600 * 1000:
+            raise ValueError("duration out of range")
+        rows.append((ev['t'], question, choice, duration, client_ts))
+    content_version = data.get('content_version')
+    return file_name, None if content_version is None else str(content_version)[:64], rows
+
+@app.route("/api/events", methods=["POST"])
+@login_required
+def ingest_events():
+    """Append a batch of answer events in one transaction"""
+    # sendBeacon posts text/plain, so parse the body whatever its content type
+    data = request.get_json(force=True, silent=True)
+    try:
+        file_name, content_version, rows = _parse_event_batch(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    user_id = session['user_id']
+    quiz = resolve_quiz(file_name, user_id)
+    if quiz is None:
+        return jsonify({"status": "error", "message": "unknown quiz file"}), 400
+    plan = get_shuffle_plan(quiz, user_id) if data.get('shuffled') else None
+    if plan is not None:
+        # Shuffled pages report delivery positions; events are stored in file order
+        rows = [(event,) + unshuffle_position(plan, question, choice) + (duration, client_ts)
+                for event, question, choice, duration, client_ts in rows if question < len(plan[0])]
+    received_at = datetime.now().isoformat()
+    with store_transaction() as conn:
+        conn.executemany(
+            'INSERT INTO answer_events (user_id, file, content_version, event, question, choice, '
+            'duration_ms, client_ts, received_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(user_id, quiz['file'], content_version, event, question, choice, duration, client_ts, received_at)
+             for event, question, choice, duration, client_ts in rows]
+        )
+
+    # Time-on-question feeds the per-question statistics (only for the current version of the file)
+    views = [(question, duration) for event, question, choice, duration, client_ts in rows
+             if event == 'v' and duration is not None]
+    if views and (content_version is None or content_version == quiz['version']):
+        ordinals = quiz['ordinals']
+        views = [(ordinals[q], ms) for q, ms in views if q < len(ordinals)]
+        record_view_times([o for o, ms in views], [ms for o, ms in views])
+    return jsonify({"status": "success", "accepted": len(rows)}), 202
+
 # ---------- TEMPLATES ----------
 
 MENU_TEMPLATE = """
@@ -1096,6 +3900,14 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
 .recently-viewed-title{font-size:18px;font-weight:700;margin-bottom:15px;color:var(--jewel-emerald);display:flex;align-items:center;gap:8px}
 .recently-viewed-items{display:grid;grid-template-columns:repeat(auto-fill,minmax(200px,1fr));gap:12px}
 .recently-viewed-item{background:var(--card);padding:12px;border-radius:8px;border:1px solid rgba(52,211,153,0.3);transition:all 0.2s}
+.mastery-panel{background:rgba(167,139,250,0.08);padding:20px;border-radius:12px;margin-bottom:30px;border:1px solid rgba(167,139,250,0.2)}
+.mastery-title{font-size:18px;font-weight:700;margin-bottom:15px;color:var(--accent-light)}
+.mastery-items{display:grid;grid-template-columns:repeat(auto-fill,minmax(220px,1fr));gap:12px}
+.mastery-item{background:var(--card);padding:12px;border-radius:8px;border:1px solid var(--card-border)}
+.mastery-name{font-weight:600;font-size:14px;color:var(--text-primary);margin-bottom:8px}
+.mastery-bar{height:6px;background:var(--card-border);border-radius:3px;overflow:hidden;margin-bottom:6px}
+.mastery-bar div{height:100%;background:linear-gradient(90deg, var(--jewel-emerald), var(--jewel-sapphire))}
+.mastery-meta{font-size:12px;color:var(--text-muted)}
 .recently-viewed-item:hover{transform:translateY(-2px);box-shadow:0 6px 20px rgba(52,211,153,0.2);border-color:var(--jewel-emerald)}
 .recently-viewed-item a{color:var(--jewel-emerald);text-decoration:none;font-weight:600;font-size:14px;display:block;margin-bottom:6px}
 .recently-viewed-item a:hover{color:var(--accent-light)}
@@ -1234,6 +4046,12 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
       <div class="number">{{ mocks|length }}</div>
       <div class="label">Mock Exams</div>
     </div>
+    {% if progress %}
+    <div class="stat-box">
+      <div class="number">{{ "{:,}".format(progress.seen) }}</div>
+      <div class="label">of {{ "{:,}".format(total_questions) }} Questions Attempted</div>
+    </div>
+    {% endif %}
   </div>
 
   <div class="search-box">
@@ -1254,14 +4072,37 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
   </div>
   {% endif %}
 
+  {% if category_mastery %}
+  <div class="mastery-panel">
+    <div class="mastery-title">📊 Your Progress by Category</div>
+    <div class="mastery-items">
+      {% for c in category_mastery %}
+      <div class="mastery-item" title="Last attempt {{ c.last_attempt[:10] }}">
+        <div class="mastery-name">{{ c.category }}</div>
+        <div class="mastery-bar"><div style="width:{{ c.coverage or 0 }}%"></div></div>
+        <div class="mastery-meta">{{ c.accuracy if c.accuracy is not none else 0 }}% correct · {{ c.questions_seen }}/{{ c.questions_total }} seen</div>
+      </div>
+      {% endfor %}
+    </div>
+  </div>
+  {% endif %}
+
   <div style="display:flex;gap:10px;margin-bottom:20px;align-items:center;flex-wrap:wrap">
     <a href="/history" class="btn btn-secondary">📋 Quiz History</a>
     <a href="/recently-viewed" class="btn btn-secondary">👁️ Recently Viewed</a>
+    <a href="/flagged" class="btn btn-secondary">🚩 Flagged Questions</a>
+    <a href="/wrong-answers" class="btn btn-secondary">❌ Review Wrong Answers</a>
+    <a href="/practice/due" class="btn btn-secondary">🧠 Practice Due ({{ due_count }})</a>
+    <a href="/build-quiz" class="btn btn-secondary">🎲 Mixed Quiz</a>
   </div>
 
   {% if mocks %}
   <div class="section">
     <div class="section-title">🎯 Mock Exams ({{ mocks|length }})</div>
+    <div style="display:flex;gap:10px;margin-bottom:20px;flex-wrap:wrap">
+      <a href="/generate-mock?session=1" class="btn btn-secondary">✨ Generate Session 1 (unseen questions)</a>
+      <a href="/generate-mock?session=2" class="btn btn-secondary">✨ Generate Session 2 (unseen questions)</a>
+    </div>
     <div class="grid" id="mockGrid">
       {% for file in mocks %}
       <div class="card" data-name="{{ file.display_name|lower }}">
@@ -1273,9 +4114,13 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
         <div class="card-meta">
           <span>📝 {{ file.questions }} questions</span>
           <span>💾 {{ file.size }}</span>
+          {% if file.mastery %}
+          <span title="Last attempt {{ (file.mastery.last_attempt or 'via a deck')[:10] }}">🎯 {{ file.mastery.accuracy if file.mastery.accuracy is not none else 0 }}% · {{ file.mastery.coverage }}% seen</span>
+          {% endif %}
         </div>
         <div class="card-actions">
           <a href="/{{ file.display_name }}" class="btn btn-primary">Start Quiz</a>
+          <a href="/{{ file.display_name }}?shuffle=1" class="btn btn-secondary" title="Questions in your own shuffled order">🔀 Shuffled</a>
         </div>
       </div>
       {% endfor %}
@@ -1307,9 +4152,13 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
         <div class="card-meta">
           <span>📝 {{ file.questions }} questions</span>
           <span>💾 {{ file.size }}</span>
+          {% if file.mastery %}
+          <span title="Last attempt {{ (file.mastery.last_attempt or 'via a deck')[:10] }}">🎯 {{ file.mastery.accuracy if file.mastery.accuracy is not none else 0 }}% · {{ file.mastery.coverage }}% seen</span>
+          {% endif %}
         </div>
         <div class="card-actions">
           <a href="/{{ file.display_name }}" class="btn btn-primary">Start Quiz</a>
+          <a href="/{{ file.display_name }}?shuffle=1" class="btn btn-secondary" title="Questions in your own shuffled order">🔀 Shuffled</a>
         </div>
       </div>
       {% endfor %}
@@ -1902,6 +4751,7 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
 .empty-icon{font-size:64px;margin-bottom:20px;opacity:0.5}
 .debug-info{background:rgba(251,191,36,0.1);padding:10px;border-radius:8px;margin:10px 0;font-size:12px;color:var(--warning);border:1px solid rgba(251,191,36,0.3);animation: fadeIn 0.5s ease-in}
 .completed-badge{background:linear-gradient(135deg, var(--jewel-emerald) 0%, var(--jewel-sapphire) 100%);color:white;padding:4px 8px;border-radius:4px;font-size:12px;margin-left:10px;font-weight:600}
+.pagination{display:flex;align-items:center;justify-content:center;gap:16px;margin-top:24px;color:var(--text-muted);font-size:14px}
 @keyframes fadeIn{from{opacity:0;transform:translateY(-10px)}to{opacity:1;transform:translateY(0)}}
 @media(max-width:768px){.grid{grid-template-columns:1fr}.user-actions{flex-direction:column;gap:10px}.btn{width:100%;text-align:center}}
 </style>
@@ -1921,7 +4771,7 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
 
   {% if history %}
   <div class="section">
-    <div class="section-title">📋 Your Quiz History ({{ history|length }})</div>
+    <div class="section-title">📋 Your Quiz History ({{ total_attempts }})</div>
     <div class="grid">
       {% for attempt in history %}
       <div class="card">
@@ -1938,11 +4788,18 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
           <span>⚪ {{ attempt.unanswered }} unanswered</span>
         </div>
         <div class="card-actions">
-          <a href="/review-answers/{{ loop.index0 }}" class="btn btn-primary">Review Answers</a>
+          <a href="/review-answers/{{ attempt.id }}" class="btn btn-primary">Review Answers</a>
         </div>
       </div>
       {% endfor %}
     </div>
+    {% if total_pages > 1 %}
+    <div class="pagination">
+      {% if page > 1 %}<a href="/history?page={{ page - 1 }}" class="btn btn-secondary">← Newer</a>{% endif %}
+      <span>Page {{ page }} of {{ total_pages }}</span>
+      {% if page < total_pages %}<a href="/history?page={{ page + 1 }}" class="btn btn-secondary">Older →</a>{% endif %}
+    </div>
+    {% endif %}
   </div>
   {% else %}
   <div class="empty">
@@ -1957,6 +4814,104 @@ body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;backgrou
 </html>
 """
 
+REVIEW_TEMPLATE = """
+<!doctype html>
+<html lang="en">
+<head>
+<meta charset="utf-8"/>
+<meta name="viewport" content="width=device-width,initial-scale=1"/>
+<title>Review Answers - CFA Level 1</title>
+<style>
+:root{--bg:#0f1419;--card:#1a202c;--card-border:#2d3748;--muted:#94a3b8;--accent:#a78bfa;--accent-dark:#8b5cf6;--accent-light:#c4b5fd;--success:#34d399;--danger:#f87171;--warning:#fbbf24;--text-primary:#f1f5f9;--text-secondary:#cbd5e1;--text-muted:#94a3b8;--gold:#d4af37;--glass-bg:rgba(255,255,255,0.05);--glass-border:rgba(255,255,255,0.1)}
+body{margin:0;font-family:'Inter','Segoe UI',Arial,Helvetica,sans-serif;background:linear-gradient(135deg, var(--bg) 0%, #1e293b 100%);color:var(--text-primary);min-height:100vh}
+.container{max-width:1100px;margin:28px auto;padding:0 18px}
+.topbar{display:flex;justify-content:space-between;align-items:center;margin-bottom:18px;background:var(--glass-bg);padding:16px;border-radius:12px;border:1px solid var(--glass-border);flex-wrap:wrap;gap:12px}
+.exam-title{font-weight:700;font-size:18px;background:linear-gradient(135deg, var(--accent-light) 0%, var(--gold) 100%);-webkit-background-clip:text;-webkit-text-fill-color:transparent;background-clip:text}
+.btn{padding:10px 14px;border-radius:8px;border:1px solid var(--glass-border);background:var(--glass-bg);cursor:pointer;font-weight:600;color:var(--text-secondary);text-decoration:none}
+.btn:hover{border-color:var(--accent)}
+.summary{display:flex;gap:16px;flex-wrap:wrap;color:var(--text-muted);font-size:13px;margin-top:6px}
+.warning{background:rgba(251,191,36,0.1);border:1px solid rgba(251,191,36,0.3);color:var(--warning);padding:12px;border-radius:8px;margin-bottom:18px;font-size:14px}
+.card{background:var(--card);padding:22px;border-radius:12px;box-shadow:0 8px 32px rgba(0,0,0,0.3);border:1px solid var(--card-border);border-left:4px solid var(--muted);margin-bottom:18px}
+.card.correct{border-left-color:var(--success)}
+.card.incorrect{border-left-color:var(--danger)}
+.q-header{display:flex;align-items:flex-start;gap:12px}
+.q-num{background:linear-gradient(135deg, #a78bfa 0%, #0ea5e9 100%);padding:8px 12px;border-radius:8px;font-weight:700;color:#000;min-width:40px;text-align:center}
+.status{font-size:13px;font-weight:600;margin-bottom:6px}
+.status.correct{color:var(--success)}
+.status.incorrect{color:var(--danger)}
+.status.skipped{color:var(--muted)}
+.question-text{font-size:15px;line-height:1.6;color:var(--text-secondary)}
+.choices{margin-top:14px;border-top:1px solid var(--card-border);padding-top:14px}
+.choice{padding:10px;margin-bottom:8px;border-radius:8px;background:var(--glass-bg);border-left:4px solid var(--card-border);color:var(--text-secondary);font-size:14px}
+.choice.correct{border-left-color:var(--success)}
+.choice.chosen{border-left-color:var(--danger)}
+.choice-label{font-weight:600;font-size:13px;margin-bottom:6px;color:var(--text-muted)}
+.choice.correct .choice-label{color:var(--success)}
+.choice.chosen .choice-label{color:var(--danger)}
+.explain{margin-top:8px;color:var(--text-muted);font-size:13px;line-height:1.5}
+.question-text table, .choice table{width:100%;border-collapse:collapse;margin:15px 0;border:1px solid rgba(167,139,250,0.3);font-size:14px}
+.question-text table th, .question-text table td, .choice table th, .choice table td{padding:12px;border:1px solid rgba(167,139,250,0.2);text-align:left;color:var(--text-secondary)}
+</style>
+</head>
+<body>
+<div class="container">
+  <div class="topbar">
+    <div>
+      <div class="exam-title">Review — {{ attempt.quiz_name }}</div>
+      <div class="summary">
+        <span>📅 {{ attempt.timestamp[:10] }} {{ attempt.timestamp[11:16] }}</span>
+        <span>💯 {{ attempt.score }}/{{ attempt.total_questions * 5 }}</span>
+        <span>📊 {{ attempt.percentage }}%</span>
+        <span>✅ {{ attempt.correct }} correct</span>
+        <span>❌ {{ attempt.incorrect }} incorrect</span>
+        <span>⚪ {{ attempt.unanswered }} unanswered</span>
+      </div>
+    </div>
+    <div style="display:flex;gap:8px">
+      <a href="/history" class="btn">📋 History</a>
+      <a href="/menu" class="btn">🏠 Menu</a>
+    </div>
+  </div>
+
+  {% if stale %}
+  <div class="warning">This quiz file has been updated since this attempt. Answers are matched by question position and may not line up exactly.</div>
+  {% endif %}
+
+  {% for item in review %}
+  {% set q = item.question %}
+  {% set per_choice = q.feedback and (q.feedback.keys() | reject('in', ['neutral', 'correct', 'incorrect']) | list) %}
+  <div class="card {{ item.status }}">
+    <div class="q-header">
+      <div class="q-num">{{ loop.index }}</div>
+      <div style="flex:1">
+        <div class="status {{ item.status }}">
+          {% if item.status == 'correct' %}Correct (+5 marks){% elif item.status == 'incorrect' %}Incorrect (0 marks){% else %}Skipped (0 marks){% endif %}
+        </div>
+        <div class="question-text">{{ (q.stem or q.title) | safe }}</div>
+      </div>
+    </div>
+    <div class="choices">
+      {% for c in q.choices %}
+      {% set is_correct = loop.index0 == item.correct %}
+      {% set is_chosen = loop.index0 == item.chosen %}
+      <div class="choice {% if is_correct %}correct{% elif is_chosen %}chosen{% endif %}">
+        <div class="choice-label">{{ "ABCDEFGHIJ"[loop.index0] }}.{% if is_correct %} ✓ Correct{% endif %}{% if is_chosen %} — Your Answer{% endif %}</div>
+        <div>{{ c.text | safe }}</div>
+        {% if q.feedback and q.feedback.get(c.id) %}
+        <div class="explain">{{ q.feedback.get(c.id) | safe }}</div>
+        {% elif is_correct and not per_choice and q.feedback and q.feedback.neutral %}
+        <div class="explain">{{ q.feedback.neutral | safe }}</div>
+        {% endif %}
+      </div>
+      {% endfor %}
+    </div>
+  </div>
+  {% endfor %}
+</div>
+</body>
+</html>
+"""
+
 RECENTLY_VIEWED_TEMPLATE = """
 <!doctype html>
 <html lang="en">
@@ -2128,7 +5083,7 @@ input[type="radio"]{width:18px;height:18px;margin-top:3px}
   <div class="topbar">
     <div>
       <div class="exam-title">All Questions — {{ total }} questions</div>
-      <div style="color:var(--muted);font-size:13px">Source: {{ data_source }}</div>
+      <div style="color:var(--muted);font-size:13px">Source: {{ quiz_name or data_source }}</div>
     </div>
     <div style="display:flex;gap:8px;align-items:center">
       <a href="/menu" class="btn" style="text-decoration:none;color:#0f1724">🏠 Home</a>
@@ -2138,7 +5093,9 @@ input[type="radio"]{width:18px;height:18px;margin-top:3px}
   </div>
 
   <div style="display:flex;gap:12px;flex-wrap:wrap;margin-bottom:20px">
-    {% if is_mock %}
+    {% if answers_hidden %}
+    <div style="color:var(--muted);font-size:14px;align-self:center">Answers are shown when you review a submitted attempt from your history.</div>
+    {% elif is_mock %}
     <button type="button" class="btn primary" onclick="showAllAnswers()" id="showAllBtn">📋 Show All Answers</button>
     <button type="button" class="btn primary" onclick="hideAllAnswers()" id="hideAllBtn" style="display:none;">🙈 Hide All Answers</button>
     {% else %}
@@ -2167,12 +5124,18 @@ input[type="radio"]{width:18px;height:18px;margin-top:3px}
         {% endfor %}
       </div>
 
-      {% if is_mock %}
+      {% if answers_hidden %}
+      <div class="controls" style="justify-content:flex-end">
+        <button type="button" class="btn flag-btn" id="flag-{{ loop.index0 }}" onclick="toggleFlag({{ loop.index0 }})">🏳️ Flag</button>
+      </div>
+      {% elif is_mock %}
       <div class="controls" style="justify-content:flex-end">
+        <button type="button" class="btn flag-btn" id="flag-{{ loop.index0 }}" onclick="toggleFlag({{ loop.index0 }})">🏳️ Flag</button>
         <button type="button" class="btn primary" onclick="showAnswer({{ loop.index0 }})">Show Answer</button>
       </div>
       {% else %}
       <div class="controls" style="justify-content:flex-end">
+        <button type="button" class="btn flag-btn" id="flag-{{ loop.index0 }}" onclick="toggleFlag({{ loop.index0 }})">🏳️ Flag</button>
         <button type="button" class="btn primary" onclick="submitQuestion({{ loop.index0 }})">Submit Answer</button>
       </div>
       {% endif %}
@@ -2197,6 +5160,54 @@ setInterval(()=> {
   document.getElementById('timer').textContent = `Time ${mm}:${ss}`;
 }, 500);
 
+// Answer events are buffered and posted in batches: every 15s and, via sendBeacon, when the page is hidden
+const eventFile = {{ data_source | tojson }};
+let eventQueue = [];
+
+function trackEvent(t, q, c, ms) {
+  eventQueue.push({t: t, q: q, c: (c === undefined ? null : c), ms: (ms === undefined ? null : Math.round(ms)), at: Date.now()});
+  if (eventQueue.length >= 200) flushEvents(false);
+}
+
+function flushEvents(useBeacon) {
+  if (!eventQueue.length) return;
+  const body = JSON.stringify({file: eventFile, content_version: {{ content_version | tojson }}, events: eventQueue});
+  eventQueue = [];
+  if (useBeacon && navigator.sendBeacon && navigator.sendBeacon('/api/events', body)) return;
+  fetch('/api/events', {method: 'POST', headers: {'Content-Type': 'application/json'}, body: body, keepalive: true})
+    .catch(err => console.error('Error sending events:', err));
+}
+
+setInterval(() => flushEvents(false), 15000);
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') flushEvents(true);
+});
+window.addEventListener('pagehide', () => flushEvents(true));
+
+// Flagged questions (positions in this quiz); the flagged deck collects them across files
+const flagged = new Set();
+
+function renderFlag(questionIdx) {
+  document.getElementById(`flag-${questionIdx}`).textContent = flagged.has(questionIdx) ? '🚩 Flagged' : '🏳️ Flag';
+}
+
+async function toggleFlag(questionIdx) {
+  const response = await fetch('/api/flags', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({file: eventFile, question: questionIdx, flagged: !flagged.has(questionIdx)})
+  });
+  const data = await response.json();
+  if (data.status !== 'success') return;
+  if (data.flagged) flagged.add(questionIdx); else flagged.delete(questionIdx);
+  renderFlag(questionIdx);
+}
+
+fetch('/api/flags/' + encodeURIComponent(eventFile))
+  .then(response => response.json())
+  .then(data => (data.flagged || []).forEach(i => { flagged.add(i); renderFlag(i); }))
+  .catch(err => console.error('Error loading flags:', err));
+
 function showAnswer(questionIdx) {
   const q = questions[questionIdx];
   const radioName = `choice-${questionIdx}`;
@@ -2262,6 +5273,7 @@ function submitQuestion(questionIdx) {
   fbDiv.innerHTML = '';
   
   userAnswers[questionIdx] = chosen.value;
+  trackEvent('a', questionIdx, (q.choices || []).findIndex(c => c.id === chosen.value));
   
   const correct = q.correct || null;
   const isCorrect = chosen.value === correct;
@@ -2423,6 +5435,13 @@ def all_questions_file(filename):
       /all-questions/uploads/myfile.json
     """
     filename = filename + ".json"
+    if DECK_FILE_RE.match(filename):
+        quiz = resolve_quiz(filename, session['user_id'])
+        if quiz is None:
+            return jsonify({"error": "deck not found"}), 404
+        # Decks can mix in mock questions, so their answers only come with the review of an attempt
+        return render_template_string(ALL_TEMPLATE, questions=questions_for_client(quiz['questions'], True), total=len(quiz['questions']), data_source=quiz['file'], quiz_name=quiz['name'], is_mock=quiz['is_mock'], content_version=quiz['version'], answers_hidden=True)
+
     tried_paths = []
     if os.path.isabs(filename):
         tried_paths.append(filename)
@@ -2432,26 +5451,27 @@ def all_questions_file(filename):
         tried_paths.append(os.path.join(UPLOAD_FOLDER, filename))
     
     chosen = None
-    for p in tried_paths:
-        if os.path.exists(p) and is_allowed_path(p):
-            chosen = os.path.abspath(p)
-            break
+    with timing_span('resolve'):
+        for p in tried_paths:
+            if os.path.exists(p) and is_allowed_path(p):
+                chosen = os.path.abspath(p)
+                break
 
     if not chosen:
         return jsonify({"error": "File not found or not allowed", "tried": tried_paths}), 404
 
     try:
-        questions, raw = load_questions_from_file(chosen)
+        questions, content_version = get_cached_questions(chosen)
     except Exception as e:
         return jsonify({"error": "Failed to load JSON", "detail": str(e)}), 500
 
-    # Determine if this is a mock exam
+    # Determine if this is a mock exam; its answers only come with the review of an attempt
     is_mock = 'Mock' in os.path.basename(chosen)
-    return render_template_string(ALL_TEMPLATE, questions=questions, total=len(questions), data_source=os.path.basename(chosen), is_mock=is_mock)
+    return render_template_string(ALL_TEMPLATE, questions=questions_for_client(questions, is_mock), total=len(questions), data_source=os.path.basename(chosen), is_mock=is_mock, content_version=content_version, answers_hidden=is_mock)
 
 
 @app.route("/debug-all-questions/<path:filename>")
-@login_required
+@admin_required
 def debug_all_questions_file(filename):
     """
     Debug route: Display all questions with detailed information about the data structure.
@@ -2466,10 +5486,11 @@ def debug_all_questions_file(filename):
         tried_paths.append(os.path.join(UPLOAD_FOLDER, filename))
     
     chosen = None
-    for p in tried_paths:
-        if os.path.exists(p) and is_allowed_path(p):
-            chosen = os.path.abspath(p)
-            break
+    with timing_span('resolve'):
+        for p in tried_paths:
+            if os.path.exists(p) and is_allowed_path(p):
+                chosen = os.path.abspath(p)
+                break
 
     if not chosen:
         return jsonify({"error": "File not found or not allowed", "tried": tried_paths}), 404
@@ -2700,38 +5721,34 @@ def authenticate_user(user_id, password):
 
 def add_login_session(user_id):
     """Record a login session for tracking"""
-    global login_history
-    
-    if user_id not in login_history:
-        login_history[user_id] = []
-    
-    # Create session entry with browser/location info
-    session_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'ip': request.remote_addr or 'Unknown',
-        'user_agent': request.headers.get('User-Agent', 'Unknown'),
-        'is_current': True
-    }
-    
-    # Mark previous sessions as not current
-    for prev_session in login_history[user_id]:
-        prev_session['is_current'] = False
-    
-    # Add new session
-    login_history[user_id].insert(0, session_entry)
-    
-    # Keep only last 20 sessions per user
-    if len(login_history[user_id]) > 20:
-        login_history[user_id] = login_history[user_id][:20]
+    with store_transaction() as conn:
+        conn.execute(
+            'INSERT INTO login_sessions (user_id, timestamp, ip, user_agent) VALUES (?, ?, ?, ?)',
+            (user_id, datetime.now().isoformat(), request.remote_addr or 'Unknown',
+             request.headers.get('User-Agent', 'Unknown'))
+        )
+        # Keep only the last MAX_LOGIN_SESSIONS sessions per user
+        conn.execute(
+            'DELETE FROM login_sessions WHERE user_id = ? AND id NOT IN '
+            '(SELECT id FROM login_sessions WHERE user_id = ? ORDER BY id DESC LIMIT ?)',
+            (user_id, user_id, MAX_LOGIN_SESSIONS)
+        )
 
 def get_session_details(user_id):
-    """Get session information for a user"""
-    global login_history
-    
-    if user_id not in login_history:
-        return []
-    
-    return login_history[user_id]
+    """Get session information for a user (newest first, the newest one is current)"""
+    rows = get_store().execute(
+        'SELECT timestamp, ip, user_agent FROM login_sessions WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+        (user_id, MAX_LOGIN_SESSIONS)
+    ).fetchall()
+    return [
+        {
+            'timestamp': row['timestamp'],
+            'ip': row['ip'],
+            'user_agent': row['user_agent'],
+            'is_current': i == 0
+        }
+        for i, row in enumerate(rows)
+    ]
 
 # Login Routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -3480,33 +6497,258 @@ def get_session_details_api():
 def file(filename):
     # Try to find the file in the data folder (case-insensitive)
     FilePath = os.path.join(DATA_FOLDER, filename + ".json")
-    print(f"Looking for file: {FilePath}")
     
     # Determine if this is a mock exam or study module
     is_mock = 'Mock' in filename
     is_module = filename.startswith('Module')
     
-    if FilePath and os.path.exists(FilePath) and is_allowed_path(FilePath):
+    content_version = None
+    shuffled = False
+    with timing_span('resolve'):
+        found = bool(FilePath) and os.path.exists(FilePath) and is_allowed_path(FilePath)
+    if found:
         try:
-            questions, raw = load_questions_from_file(FilePath)
+            questions, content_version = get_cached_questions(FilePath)
+            note_quiz_file(os.path.basename(FilePath), FilePath, len(questions))
+            if request.args.get('shuffle') == '1':
+                quiz = resolve_quiz(os.path.basename(FilePath), session['user_id'])
+                questions = shuffled_questions(questions, get_shuffle_plan(quiz, session['user_id']))
+                shuffled = True
             # Track recently viewed item
             add_to_recently_viewed(session, {'name': filename})
         except Exception as e:
             print(f"Error loading file: {e}")
             questions = []
     else:
-        print(f"File not found: {FilePath}")
         questions = []
     
     return render_template_string(
         TEMPLATE,
-        questions=questions,
+        questions=questions_for_client(questions, is_mock),
         total=len(questions),
         data_source=(os.path.basename(FilePath) if FilePath else "none"),
         is_mock=is_mock,
-        is_module=is_module
+        is_module=is_module,
+        content_version=content_version,
+        shuffled=shuffled
     )
 
+# ---------- startup report and warmup ----------
+# Importing this module defers most work to the first request that needs it: parsing and indexing
+# the data files, assigning question ordinals and compiling the page templates. With WARMUP=1 all
+# of it is done at import, which under gunicorn (without --preload) happens in the worker before
+# it accepts connections, so a restarted or newly scaled worker never serves a cold request.
+# /admin/startup reports where the startup time went and each route's first-request latency.
+WARMUP = os.environ.get('WARMUP') == '1'
+# Session user for the warmup requests; it only ever reads from the store
+WARMUP_USER = '__warmup__'
+
+STARTUP_REPORT = {'pid': os.getpid(), 'warmup': None}
+_first_requests = {}
+
+def page_templates():
+    """The module's page templates by name"""
+    return {name: value for name, value in globals().items()
+            if (name == 'TEMPLATE' or name.endswith('_TEMPLATE')) and isinstance(value, str)}
+
+def _warmup_routes():
+    names = [os.path.basename(p)[:-5] for p in data_file_paths()]
+    module = next((n for n in names if n.startswith('Module')), None)
+    mock = next((n for n in names if 'Mock' in n), None)
+    routes = [('login', '/login'), ('menu', '/menu'), ('history', '/history')]
+    if module:
+        routes += [('module quiz', '/' + module), ('all questions', '/all-questions/' + module)]
+    if mock:
+        routes.append(('mock quiz', '/' + mock))
+    return routes
+
+def load_corpus(paths):
+    """Parse, normalize and index every data file (never call inside a store transaction)"""
+    for path in paths:
+        get_answer_key(path)
+        get_question_ordinals(path)
+    corpus_index()
+    corpus_category_totals()
+
+def compile_page_templates():
+    """Compile every page template into the template cache; returns seconds per template"""
+    templates = {}
+    for name, source in page_templates().items():
+        step = time.perf_counter()
+        app.jinja_env.from_string(source)
+        templates[name] = round(time.perf_counter() - step, 4)
+    return templates
+
+def warmup():
+    """Do the deferred startup work now and record how long each part took"""
+    started = time.perf_counter()
+    report = {}
+
+    step = time.perf_counter()
+    paths = data_file_paths()
+    report['folder_discovery_seconds'] = round(time.perf_counter() - step, 4)
+    report['data_files'] = len(paths)
+
+    step = time.perf_counter()
+    load_corpus(paths)
+    report['data_seconds'] = round(time.perf_counter() - step, 4)
+
+    report['template_compile_seconds'] = compile_page_templates()
+
+    # Render each major page once, so first-use work inside the views is done too
+    client = app.test_client()
+    with client.session_transaction() as warmup_session:
+        warmup_session['user_id'] = WARMUP_USER
+        warmup_session['user_role'] = 'user'
+    requests_report = {}
+    for label, url in _warmup_routes():
+        step = time.perf_counter()
+        response = client.get(url)
+        requests_report[label] = {'path': url, 'status': response.status_code,
+                                  'ms': round((time.perf_counter() - step) * 1000, 2)}
+    report['requests'] = requests_report
+    report['seconds'] = round(time.perf_counter() - started, 4)
+
+    # Warmup traffic is not user traffic, and a store connection must not be inherited by
+    # forked workers (gunicorn --preload)
+    with _metric_shards_lock:
+        for shard in _metric_shards:
+            shard['counters'].clear()
+            shard['histograms'].clear()
+    conn = getattr(_store_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _store_local.conn = None
+    _first_requests.clear()
+    STARTUP_REPORT['warmup'] = report
+    return report
+
+@app.after_request
+def _record_first_request(response):
+    route = _metric_route()
+    if route not in _first_requests:
+        _first_requests[route] = {
+            'ms': round((time.perf_counter() - g.metrics_start) * 1000, 2),
+            'status': response.status_code,
+            'at': datetime.now().isoformat(timespec='seconds'),
+        }
+    return response
+
+@app.route("/admin/startup")
+@admin_required
+def startup_report():
+    """Import and warmup timings of this worker, and the latency of the first request to each route"""
+    compiled = app.jinja_env.string_templates
+    return jsonify(dict(
+        STARTUP_REPORT,
+        pid=os.getpid(),
+        warmup_enabled=WARMUP,
+        templates_compiled=sorted(name for name, source in page_templates().items() if source in compiled),
+        first_requests=_first_requests,
+    ))
+
+# ---------- health checks ----------
+# /healthz (liveness) answers as long as the worker can serve requests at all. /readyz (readiness,
+# Render's healthCheckPath) is 200 only when this worker is warm: every data file parsed into the
+# question cache, the corpus index built over the current versions, the page templates compiled
+# and the store reachable. A cold or partly stale worker answers 503 and refreshes itself in the
+# background, so a deploy or a data upload only briefly takes it out of rotation. Both endpoints
+# are unauthenticated and report counts only.
+_refresh_thread = None
+_refresh_lock = threading.Lock()
+
+def _refresh_caches():
+    try:
+        load_corpus(data_file_paths())
+        compile_page_templates()
+    except Exception as e:
+        print(f"Background cache refresh failed: {e}")
+
+def refresh_caches_async():
+    """Load whatever is missing or stale in a background thread (at most one at a time)"""
+    global _refresh_thread
+    with _refresh_lock:
+        if _refresh_thread is None or not _refresh_thread.is_alive():
+            _refresh_thread = threading.Thread(target=_refresh_caches, name='cache-refresh', daemon=True)
+            _refresh_thread.start()
+
+def readiness():
+    """Warmness of this worker's caches, without loading anything: (ready, checks)"""
+    now = time.time()
+    paths = data_file_paths()
+    missing = stale = 0
+    stale_seconds = 0.0
+    versions = []
+    for path in paths:
+        entry = _question_cache.get(os.path.abspath(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # removed since it was listed
+        if entry is None:
+            missing += 1
+        elif entry[0] != (st.st_mtime_ns, st.st_size):
+            stale += 1
+            stale_seconds = max(stale_seconds, now - st.st_mtime)
+        else:
+            versions.append((path, entry[2]))
+    data_folder_mtime = os.path.getmtime(DATA_FOLDER) if os.path.exists(DATA_FOLDER) else None
+    catalog = {
+        'ok': missing == 0 and stale == 0,
+        'files': len(paths),
+        'cached': len(paths) - missing - stale,
+        'missing': missing,
+        'stale': stale,
+        'stale_seconds': round(stale_seconds, 1),
+        'data_folder_modified': datetime.fromtimestamp(data_folder_mtime).isoformat(timespec='seconds') if data_folder_mtime else None,
+    }
+
+    index_signature = _corpus_index.get('signature')
+    corpus = {
+        'ok': catalog['ok'] and index_signature == tuple(versions),
+        'built': index_signature is not None,
+        'questions': int((_corpus_index['file_of'] >= 0).sum()) if index_signature is not None else 0,
+    }
+
+    names = page_templates()
+    compiled = sum(1 for source in names.values() if source in app.jinja_env.string_templates)
+    templates = {'ok': compiled == len(names), 'compiled': compiled, 'total': len(names)}
+
+    try:
+        get_store().execute('SELECT 1').fetchone()
+        store = {'ok': True}
+    except sqlite3.Error as e:
+        store = {'ok': False, 'error': str(e)}
+
+    checks = {'store': store, 'catalog': catalog, 'corpus_index': corpus, 'templates': templates}
+    return all(c['ok'] for c in checks.values()), checks
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the worker is up and serving requests"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: 200 when this worker is warm, otherwise 503 (and it starts warming up)"""
+    ready, checks = readiness()
+    if not ready and checks['store']['ok']:
+        refresh_caches_async()
+    return jsonify({
+        'status': 'ready' if ready else 'warming',
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.perf_counter() - _import_started, 1),
+        'warmup_enabled': WARMUP,
+        'checks': checks,
+        'memory': _process_memory(),
+    }), 200 if ready else 503
+
+STARTUP_REPORT['import_seconds'] = round(time.perf_counter() - _import_started, 4)
+if WARMUP:
+    warmup()
+    print(f"Warmup done in {STARTUP_REPORT['warmup']['seconds']:.2f}s "
+          f"(import {STARTUP_REPORT['import_seconds']:.2f}s, pid {os.getpid()})")
+
 if __name__ == "__main__":
     # Use environment variable for port (Render sets this)
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,207 @@
+"""
+Benchmark the question-loading pipeline over every file in data/.
+
+Each file is measured cold (its first load in this process) and warm (median of the repeats that
+follow), split into read, JSON parse, _find_items_structure and normalization, plus the end-to-end
+load_questions_from_file time. Peak memory comes from a separate tracemalloc pass so tracing does
+not distort the timings.
+
+    python benchmarks/bench_loading.py --output before.json
+    python benchmarks/bench_loading.py --compare before.json --threshold 10
+
+With --compare the run exits with status 1 when any file's warm load time got slower than the
+baseline by more than --threshold percent (and by at least --min-delta-ms, to ignore noise on
+tiny files).
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import app  # noqa: E402
+
+PHASES = ('read_ms', 'parse_ms', 'find_items_ms', 'normalize_ms', 'load_ms')
+
+
+def _ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def time_pipeline(path):
+    """One pass over a file: milliseconds per phase, the item count and the normalized questions"""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        read_ms = _ms(start)
+
+        start = time.perf_counter()
+        raw = json.loads(text)
+        parse_ms = _ms(start)
+
+        start = time.perf_counter()
+        items = app._find_items_structure(raw)
+        find_items_ms = _ms(start)
+
+        start = time.perf_counter()
+        app.normalize_questions(raw)
+        normalize_ms = _ms(start)
+
+        start = time.perf_counter()
+        questions, _ = app.load_questions_from_file(path)
+        load_ms = _ms(start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    timings = {'read_ms': read_ms, 'parse_ms': parse_ms, 'find_items_ms': find_items_ms,
+               'normalize_ms': normalize_ms, 'load_ms': load_ms}
+    return timings, len(items), questions
+
+
+def peak_memory(path):
+    """Peak bytes allocated while loading one file"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        app.load_questions_from_file(path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_file(path, repeat):
+    cold, items, questions = time_pipeline(path)
+    warm_runs = [time_pipeline(path)[0] for _ in range(repeat)]
+    warm = {phase: statistics.median(run[phase] for run in warm_runs) for phase in PHASES}
+    return {
+        'bytes': os.path.getsize(path),
+        'items': items,
+        'questions': len(questions),
+        'cold': {phase: round(v, 3) for phase, v in cold.items()},
+        'warm': {phase: round(v, 3) for phase, v in warm.items()},
+        'items_per_sec': round(items / (warm['load_ms'] / 1000), 1) if warm['load_ms'] else None,
+        'peak_memory_bytes': peak_memory(path),
+        'output_bytes': len(json.dumps(questions, ensure_ascii=False).encode('utf-8')),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(data_folder, repeat, match=None):
+    paths = [os.path.join(data_folder, f) for f in sorted(os.listdir(data_folder))
+             if f.endswith('.json') and (match is None or match.lower() in f.lower())]
+    files = {}
+    for path in paths:
+        files[os.path.basename(path)] = bench_file(path, repeat)
+
+    totals = {
+        'files': len(files),
+        'bytes': sum(f['bytes'] for f in files.values()),
+        'items': sum(f['items'] for f in files.values()),
+        'cold': {phase: round(sum(f['cold'][phase] for f in files.values()), 3) for phase in PHASES},
+        'warm': {phase: round(sum(f['warm'][phase] for f in files.values()), 3) for phase in PHASES},
+        'max_peak_memory_bytes': max((f['peak_memory_bytes'] for f in files.values()), default=0),
+        'output_bytes': sum(f['output_bytes'] for f in files.values()),
+    }
+    totals['items_per_sec'] = (round(totals['items'] / (totals['warm']['load_ms'] / 1000), 1)
+                               if totals['warm']['load_ms'] else None)
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'data_folder': os.path.abspath(data_folder),
+        },
+        'totals': totals,
+        'files': files,
+    }
+
+
+def compare(result, baseline, threshold, min_delta_ms):
+    """Files whose warm load time regressed past the threshold, worst first"""
+    regressions = []
+    for name, current in result['files'].items():
+        before = baseline['files'].get(name)
+        if before is None:
+            continue
+        old, new = before['warm']['load_ms'], current['warm']['load_ms']
+        if new - old >= min_delta_ms and old > 0 and (new - old) / old * 100 > threshold:
+            regressions.append({'file': name, 'baseline_ms': old, 'current_ms': new,
+                                'change_pct': round((new - old) / old * 100, 1)})
+    regressions.sort(key=lambda r: -r['change_pct'])
+    return regressions
+
+
+def print_report(result, top):
+    files = sorted(result['files'].items(), key=lambda item: -item[1]['warm']['load_ms'])
+    print(f"{'file':<60} {'items':>5} {'KiB':>7} {'cold ms':>8} {'parse':>7} {'norm':>7} {'warm ms':>8} "
+          f"{'items/s':>9} {'peak KiB':>9} {'out KiB':>8}")
+    for name, f in files[:top]:
+        print(f"{name[:60]:<60} {f['items']:>5} {f['bytes'] / 1024:>7.1f} {f['cold']['load_ms']:>8.2f} "
+              f"{f['warm']['parse_ms']:>7.2f} {f['warm']['normalize_ms']:>7.2f} {f['warm']['load_ms']:>8.2f} "
+              f"{f['items_per_sec'] or 0:>9.0f} {f['peak_memory_bytes'] / 1024:>9.1f} {f['output_bytes'] / 1024:>8.1f}")
+    t = result['totals']
+    print(f"\n{t['files']} files, {t['items']} items, {t['bytes'] / 1024 / 1024:.1f} MiB: "
+          f"cold {t['cold']['load_ms']:.1f} ms, warm {t['warm']['load_ms']:.1f} ms "
+          f"(parse {t['warm']['parse_ms']:.1f}, normalize {t['warm']['normalize_ms']:.1f}), "
+          f"{t['items_per_sec'] or 0:.0f} items/s, max peak {t['max_peak_memory_bytes'] / 1024 / 1024:.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data', default=app.DATA_FOLDER, help='folder of quiz JSON files (default: data/)')
+    parser.add_argument('--repeat', type=int, default=5, help='warm runs per file; the median is reported')
+    parser.add_argument('--match', help='only files whose name contains this text')
+    parser.add_argument('--output', help='write the full results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed slowdown per file in percent')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help='ignore slowdowns smaller than this many milliseconds')
+    parser.add_argument('--top', type=int, default=20, help='files shown in the table, slowest first')
+    args = parser.parse_args(argv)
+
+    result = run(args.data, max(args.repeat, 1), args.match)
+    print_report(result, args.top)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold, args.min_delta_ms)
+        result['comparison'] = {'baseline': baseline['meta'], 'threshold_pct': args.threshold,
+                                'regressions': regressions}
+        if regressions:
+            print(f"\n{len(regressions)} file(s) slower than the baseline by more than {args.threshold:g}%:")
+            for r in regressions:
+                print(f"  {r['file']}: {r['baseline_ms']:.2f} ms -> {r['current_ms']:.2f} ms (+{r['change_pct']}%)")
+        else:
+            print(f"\nNo file slower than the baseline by more than {args.threshold:g}%")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
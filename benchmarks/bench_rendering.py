@@ -0,0 +1,204 @@
+"""
+Benchmark rendering of the heaviest pages with real data.
+
+Each case requests the page once through the test client to capture the compiled template and
+the exact context its view renders with, then times template.render(context) alone: median and
+minimum over --repeat runs, output bytes (raw and gzipped, i.e. page weight on the wire) and the
+peak memory allocated while rendering (from a separate tracemalloc pass).
+
+    python benchmarks/bench_rendering.py --output before.json
+    python benchmarks/bench_rendering.py --compare before.json
+
+With --compare the run exits with status 1 when a case renders slower than the baseline by more
+than --threshold percent (and by at least --min-delta-ms) or its output grew by more than
+--bytes-threshold percent.
+"""
+import argparse
+import atexit
+import gc
+import gzip
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+STORE_FOLDER = tempfile.mkdtemp(prefix='cfa-bench-')
+os.environ['STORE_FOLDER'] = STORE_FOLDER  # before the app is imported
+
+import app  # noqa: E402
+from flask import template_rendered  # noqa: E402
+
+atexit.register(shutil.rmtree, STORE_FOLDER, True)
+
+MODULE_FILE = 'Module 91 Guidance for Standards I–VII'  # the largest module (283 questions)
+MOCK_FILE = '2026 CFA Program LI Mock Exam 1 Session 1'  # 90 questions
+BENCH_USER = '__bench__'
+
+# name: (template, page requested to capture its context)
+CASES = {
+    'quiz_module': ('TEMPLATE', '/' + MODULE_FILE),
+    'quiz_mock': ('TEMPLATE', '/' + MOCK_FILE),
+    'all_questions_module': ('ALL_TEMPLATE', '/all-questions/' + MODULE_FILE),
+    'all_questions_mock': ('ALL_TEMPLATE', '/all-questions/' + MOCK_FILE),
+    'menu': ('MENU_TEMPLATE', '/menu'),
+}
+
+
+def capture(path):
+    """(template, context) of the page the view at path renders"""
+    client = app.app.test_client()
+    with client.session_transaction() as bench_session:
+        bench_session['user_id'] = BENCH_USER
+        bench_session['user_role'] = 'user'
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append((template, dict(context)))
+
+    with template_rendered.connected_to(record, app.app):
+        response = client.get(path)
+    if response.status_code != 200 or not rendered:
+        raise SystemExit(f'{path} did not render a page (status {response.status_code})')
+    return rendered[-1]
+
+
+def render_once(template, context, path):
+    with app.app.test_request_context(path):
+        return template.render(context)
+
+
+def bench_case(template_name, path, repeat):
+    template, context = capture(path)
+    if template is not app.app.jinja_env.string_templates.get(getattr(app, template_name)):
+        raise SystemExit(f'{path} was not rendered with {template_name}')
+    html = render_once(template, context, path)  # first render after compiling, not timed
+
+    times = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            render_once(template, context, path)
+            times.append((time.perf_counter() - start) * 1000)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        render_once(template, context, path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    body = html.encode('utf-8')
+    return {
+        'template': template_name,
+        'path': path,
+        'questions': context.get('total', len(context.get('files') or [])),
+        'render_ms': round(statistics.median(times), 3),
+        'render_min_ms': round(min(times), 3),
+        'output_bytes': len(body),
+        'gzip_bytes': len(gzip.compress(body, 6)),
+        'peak_alloc_bytes': peak,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat, only=None):
+    cases = {name: bench_case(template_name, path, repeat)
+             for name, (template_name, path) in CASES.items() if only is None or name in only}
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'cases': cases,
+    }
+
+
+def compare(result, baseline, threshold, min_delta_ms, bytes_threshold):
+    """Cases that got slower or heavier than the baseline allows"""
+    regressions = []
+    for name, current in result['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        old, new = before['render_ms'], current['render_ms']
+        if new - old >= min_delta_ms and old > 0 and (new - old) / old * 100 > threshold:
+            regressions.append({'case': name, 'metric': 'render_ms', 'baseline': old, 'current': new,
+                                'change_pct': round((new - old) / old * 100, 1)})
+        old, new = before['output_bytes'], current['output_bytes']
+        if old > 0 and (new - old) / old * 100 > bytes_threshold:
+            regressions.append({'case': name, 'metric': 'output_bytes', 'baseline': old, 'current': new,
+                                'change_pct': round((new - old) / old * 100, 1)})
+    return regressions
+
+
+def print_report(result):
+    print(f"{'case':<22} {'template':<14} {'items':>5} {'render ms':>10} {'min ms':>8} {'KiB':>8} "
+          f"{'gzip KiB':>9} {'peak KiB':>9}")
+    for name, c in result['cases'].items():
+        print(f"{name:<22} {c['template']:<14} {c['questions']:>5} {c['render_ms']:>10.2f} {c['render_min_ms']:>8.2f} "
+              f"{c['output_bytes'] / 1024:>8.1f} {c['gzip_bytes'] / 1024:>9.1f} {c['peak_alloc_bytes'] / 1024:>9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='timed renders per case; the median is reported')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), help='only these cases (repeatable)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed render slowdown in percent')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help='ignore render slowdowns smaller than this many milliseconds')
+    parser.add_argument('--bytes-threshold', type=float, default=2.0, help='allowed output growth in percent')
+    args = parser.parse_args(argv)
+
+    result = run(max(args.repeat, 1), args.case)
+    print_report(result)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold, args.min_delta_ms, args.bytes_threshold)
+        result['comparison'] = {'baseline': baseline['meta'], 'threshold_pct': args.threshold,
+                                'bytes_threshold_pct': args.bytes_threshold, 'regressions': regressions}
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against the baseline:")
+            for r in regressions:
+                print(f"  {r['case']} {r['metric']}: {r['baseline']} -> {r['current']} (+{r['change_pct']}%)")
+        else:
+            print("\nNo regressions against the baseline")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+Load test: a cohort of students taking a mock exam at the same time.
+
+Every simulated student logs in, opens the menu, opens a mock, answers every question the way the
+quiz page does (an autosave after each answer, answer and view events in batches), posts the
+result to /save-quiz-result and views /history. Latency is recorded per route and reported as
+throughput and p50/p95/p99.
+
+    python benchmarks/load_cohort.py --students 20                       # in-process test client
+    python benchmarks/load_cohort.py --students 50 --gunicorn-workers 4  # local gunicorn
+    python benchmarks/load_cohort.py --url http://127.0.0.1:8000 --user aaryan:secret
+
+The test client and the local gunicorn both use a throwaway STORE_FOLDER, so simulated attempts
+never reach the real store. Against --url the attempts are saved for the given accounts.
+Accounts come from --user (repeatable, id:password) or, by default, the valid users in
+config/users.json; students share accounts round-robin.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+QUESTIONS_RE = re.compile(r'^const questions = (.*);\s*$', re.MULTILINE)
+CONTENT_VERSION_RE = re.compile(r'content_version: ("[^"]*"|null),')
+EVENT_BATCH_SIZE = 20
+
+
+class TestClientSession:
+    """One student's cookie session against the app in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None):
+        response = self.client.open(path, method=method, json=json_body, data=form)
+        return response.status_code, response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # report the 302 itself, like the test client does
+
+
+class HttpSession:
+    """One student's cookie session against a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, json_body=None, form=None):
+        headers, body = {}, None
+        if json_body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(json_body).encode('utf-8')
+        elif form is not None:
+            body = urllib.parse.urlencode(form).encode('utf-8')
+        req = urllib.request.Request(self.base_url + urllib.parse.quote(path, safe='/?=&'),
+                                     data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Recorder:
+    """Latencies and failures per route label, shared by all student threads"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def call(self, session, label, method, path, expect=200, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = session.request(method, path, **kwargs)
+        except OSError as e:
+            status, body = None, str(e).encode()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.setdefault(label, []).append(elapsed)
+            if status != expect:
+                self.errors[label] = self.errors.get(label, 0) + 1
+        if status != expect:
+            raise RuntimeError(f'{label} returned {status}: {body[:200]!r}')
+        return body
+
+
+def simulate_student(session, recorder, user_id, password, mock, think, rng):
+    """One student's whole session; raises RuntimeError when a step fails"""
+    recorder.call(session, 'POST /login', 'POST', '/login', expect=302,
+                  form={'user_id': user_id, 'password': password})
+    recorder.call(session, 'GET /menu', 'GET', '/menu')
+    page = recorder.call(session, 'GET /<mock>', 'GET', '/' + mock).decode('utf-8')
+    questions_match = QUESTIONS_RE.search(page)
+    version_match = CONTENT_VERSION_RE.search(page)
+    if not questions_match or not version_match:
+        raise RuntimeError(f'could not find the questions on the quiz page of {mock}')
+    questions = json.loads(questions_match.group(1))
+    content_version = json.loads(version_match.group(1))
+    file_name = mock + '.json'
+    recorder.call(session, 'GET /api/autosave', 'GET', f'/api/autosave/{mock}.json')
+    recorder.call(session, 'GET /api/flags', 'GET', f'/api/flags/{mock}.json')
+
+    answers = [-1] * len(questions)
+    status = [0] * len(questions)
+    events = []
+    started = time.time()
+    for i, question in enumerate(questions):
+        if think:
+            time.sleep(rng.uniform(0.5, 1.5) * think)
+        answers[i] = rng.randrange(max(len(question.get('choices') or []), 1))
+        status[i] = 1
+        now_ms = int(time.time() * 1000)
+        events.append({'t': 'a', 'q': i, 'c': answers[i], 'ms': None, 'at': now_ms})
+        events.append({'t': 'v', 'q': i, 'c': None, 'ms': int(think * 1000), 'at': now_ms})
+        recorder.call(session, 'POST /api/autosave', 'POST', f'/api/autosave/{mock}.json', json_body={
+            'answers': answers, 'status': status, 'current': i,
+            'elapsed_seconds': int(time.time() - started), 'content_version': content_version,
+        })
+        if len(events) >= EVENT_BATCH_SIZE or i == len(questions) - 1:
+            recorder.call(session, 'POST /api/events', 'POST', '/api/events', expect=202, json_body={
+                'file': file_name, 'content_version': content_version, 'events': events})
+            events = []
+
+    recorder.call(session, 'POST /save-quiz-result', 'POST', '/save-quiz-result', json_body={
+        'file': file_name, 'quiz_name': mock, 'content_version': content_version,
+        'answers': answers, 'duration_seconds': int(time.time() - started),
+    })
+    recorder.call(session, 'GET /history', 'GET', '/history')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(recorder, wall_seconds, students, failed):
+    routes = {}
+    for label, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        routes[label] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(label, 0),
+            'rps': round(len(values) / wall_seconds, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2),
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return {
+        'students': students,
+        'completed': students - failed,
+        'failed': failed,
+        'wall_seconds': round(wall_seconds, 3),
+        'requests': total,
+        'errors': sum(r['errors'] for r in routes.values()),
+        'rps': round(total / wall_seconds, 2),
+        'students_per_minute': round((students - failed) / wall_seconds * 60, 2),
+        'routes': routes,
+    }
+
+
+def print_summary(summary):
+    print(f"{'route':<26} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for label, r in summary['routes'].items():
+        print(f"{label:<26} {r['requests']:>8} {r['errors']:>6} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['max_ms']:>8.1f}")
+    print(f"\n{summary['completed']}/{summary['students']} students finished in {summary['wall_seconds']:.1f} s: "
+          f"{summary['requests']} requests ({summary['errors']} errors), {summary['rps']:.1f} req/s, "
+          f"{summary['students_per_minute']:.1f} students/min")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, store_folder):
+    """A local gunicorn serving app:app on a free port; returns (process, base_url) once it answers"""
+    port = _free_port()
+    env = dict(os.environ, STORE_FOLDER=store_folder)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+         '--log-level', 'warning', 'app:app'],
+        cwd=BASE_DIR, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            with urllib.request.urlopen(base_url + '/login', timeout=2):
+                return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+
+def default_accounts():
+    import app
+    return [(u['id'], u['password']) for u in app.load_users()['users'] if app.is_user_valid(u)]
+
+
+def default_mock(data_folder):
+    mocks = sorted(f[:-5] for f in os.listdir(data_folder) if f.endswith('.json') and 'Mock' in f)
+    if not mocks:
+        raise SystemExit(f'no mock exams in {data_folder}')
+    return mocks[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=10, help='simulated students (one thread each)')
+    parser.add_argument('--mock', help='mock exam to take, without .json (default: the first mock in data/)')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='average seconds spent per question (0 = as fast as possible)')
+    parser.add_argument('--ramp', type=float, default=0.0, help='seconds over which students start')
+    parser.add_argument('--url', help='run against this server instead of the in-process test client')
+    parser.add_argument('--gunicorn-workers', type=int, help='start a local gunicorn with this many workers')
+    parser.add_argument('--user', action='append', metavar='ID:PASSWORD', help='account to log in with (repeatable)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the simulated answers')
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    args = parser.parse_args(argv)
+
+    store_folder = None
+    if not args.url:
+        store_folder = tempfile.mkdtemp(prefix='cfa-load-')
+        os.environ['STORE_FOLDER'] = store_folder  # before the app is imported
+    accounts = [tuple(u.split(':', 1)) for u in args.user] if args.user else default_accounts()
+    if not accounts or any(len(a) != 2 for a in accounts):
+        raise SystemExit('no accounts: pass --user ID:PASSWORD')
+    mock = args.mock or default_mock(os.path.join(BASE_DIR, 'data'))
+
+    process = None
+    try:
+        if args.gunicorn_workers:
+            process, base_url = start_gunicorn(args.gunicorn_workers, store_folder)
+            make_session = lambda: HttpSession(base_url)
+        elif args.url:
+            make_session = lambda: HttpSession(args.url)
+        else:
+            import app
+            make_session = lambda: TestClientSession(app.app)
+
+        recorder = Recorder()
+        failures = []
+
+        def run_student(n):
+            time.sleep(args.ramp * n / max(args.students, 1))
+            user_id, password = accounts[n % len(accounts)]
+            try:
+                simulate_student(make_session(), recorder, user_id, password, mock, args.think,
+                                 random.Random(args.seed * 100003 + n))
+            except RuntimeError as e:
+                failures.append(str(e))
+
+        threads = [threading.Thread(target=run_student, args=(n,)) for n in range(args.students)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall_seconds = time.perf_counter() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if store_folder is not None:
+            if not args.url and not args.gunicorn_workers:
+                import app
+                app.flush_autosave()  # write the pending snapshots now, not at exit into a deleted store
+            shutil.rmtree(store_folder, ignore_errors=True)
+
+    summary = summarize(recorder, wall_seconds, args.students, len(failures))
+    summary.update(mock=mock, think_seconds=args.think,
+                   target=args.url or (f'gunicorn x{args.gunicorn_workers}' if args.gunicorn_workers else 'test client'))
+    print(f"{args.students} students taking {mock} against {summary['target']}\n")
+    print_summary(summary)
+    for failure in failures[:5]:
+        print(f'  failed: {failure}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary written to {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
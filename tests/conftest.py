@@ -0,0 +1,21 @@
+"""Shared test setup: the app is imported once, with its SQLite store in a temporary folder."""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+STORE_FOLDER = tempfile.mkdtemp(prefix='cfa-test-')
+os.environ['STORE_FOLDER'] = STORE_FOLDER  # before the app is imported
+
+import app  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def store():
+    yield
+    app.flush_autosave()
+    shutil.rmtree(STORE_FOLDER, True)
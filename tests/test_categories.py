@@ -0,0 +1,26 @@
+"""Curriculum categories of the mock exam questions."""
+import os
+
+import app
+
+MOCK_PATHS = [p for p in app.data_file_paths() if not app.get_module_number(os.path.basename(p))]
+
+
+def test_mock_questions_are_classified():
+    categories = [app.GRADING_CATEGORIES[c] for p in MOCK_PATHS for c in app.get_answer_key(p)['categories']]
+    assert len(categories) > 1000
+    assert categories.count('Unclassified') / len(categories) < 0.01
+
+
+def test_topic_model_agrees_with_topic_tags():
+    agree = total = 0
+    for path in MOCK_PATHS:
+        name = os.path.basename(path)
+        tagged = [(q, app.question_category(name, q)) for q in app.get_cached_questions(path)[0]]
+        tagged = [(q, c) for q, c in tagged if c != 'Unclassified']
+        covered = {c for _, c in tagged}
+        for q, category in tagged:
+            agree += app.classify_topic(q, covered) == category
+            total += 1
+    assert total > 500
+    assert agree / total > 0.9
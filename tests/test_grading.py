@@ -0,0 +1,52 @@
+"""Vectorized grading of attempts against a compiled answer key."""
+import numpy as np
+
+import app
+
+
+def make_key(correct, categories):
+    """Answer key shaped like get_answer_key() builds it"""
+    categories = np.array([app.GRADING_CATEGORIES.index(c) for c in categories], dtype=np.int8)
+    category_matrix = np.zeros((len(categories), len(app.GRADING_CATEGORIES)), dtype=np.int32)
+    category_matrix[np.arange(len(categories)), categories] = 1
+    return {'correct': np.array(correct, dtype=np.int8), 'categories': categories, 'category_matrix': category_matrix}
+
+
+KEY = make_key([0, 2, 1, -1], ['Equity', 'Equity', 'Fixed Income', 'Unclassified'])
+
+
+def test_grades_every_attempt_at_once():
+    graded = app.grade_attempts(KEY, [
+        [0, 2, 1, -1],  # all keyed questions right
+        [1, 2, -1, -1],  # one right, one wrong, one skipped
+        [-1, -1, -1, -1],  # nothing answered
+    ])
+    assert graded['correct_count'].tolist() == [3, 1, 0]
+    assert graded['incorrect_count'].tolist() == [0, 1, 0]
+    assert graded['unanswered_count'].tolist() == [1, 2, 4]
+    assert graded['scores'].tolist() == [3 * app.MARKS_PER_CORRECT, app.MARKS_PER_CORRECT, 0]
+    assert app.MARKS_PER_CORRECT == 5
+
+
+def test_short_vectors_are_padded_and_long_ones_truncated():
+    graded = app.grade_attempts(KEY, [[0], [0, 2, 1, -1, 3, 3]])
+    assert graded['answers'].tolist() == [[0, -1, -1, -1], [0, 2, 1, -1]]
+    assert graded['answered'][0].tolist() == [True, False, False, False]
+    assert graded['correct_count'].tolist() == [1, 3]
+
+
+def test_answer_to_a_question_without_key_counts_as_incorrect():
+    graded = app.grade_attempts(KEY, [[-1, -1, -1, 0]])
+    assert not graded['correct'][0, 3]
+    assert graded['incorrect_count'].tolist() == [1]
+
+
+def test_category_breakdown():
+    graded = app.grade_attempts(KEY, [[0, 1, 1, -1]])
+    equity = app.GRADING_CATEGORIES.index('Equity')
+    fixed_income = app.GRADING_CATEGORIES.index('Fixed Income')
+    assert graded['category_answered'][0, equity] == 2
+    assert graded['category_correct'][0, equity] == 1
+    assert graded['category_answered'][0, fixed_income] == 1
+    assert graded['category_correct'][0, fixed_income] == 1
+    assert graded['category_answered'].sum() == 3
@@ -0,0 +1,41 @@
+"""Stratified allocation of quiz questions across categories."""
+import numpy as np
+
+import app
+
+
+def test_quotas_follow_weights_and_sum_to_n():
+    alloc = app.allocate_stratified([1, 1, 2], [100, 100, 100], 20)
+    assert alloc.tolist() == [5, 5, 10]
+    assert alloc.sum() == 20
+
+
+def test_rounding_goes_to_largest_remainders():
+    alloc = app.allocate_stratified([1, 1, 1], [100, 100, 100], 10)
+    assert alloc.sum() == 10
+    assert sorted(alloc.tolist()) == [3, 3, 4]
+
+
+def test_quotas_are_capped_by_availability():
+    alloc = app.allocate_stratified([1, 1, 1], [2, 50, 50], 30)
+    assert alloc[0] == 2
+    assert alloc.sum() == 30
+    assert (alloc <= [2, 50, 50]).all()
+
+
+def test_asking_for_more_than_available_takes_everything():
+    alloc = app.allocate_stratified([3, 1, 0], [4, 5, 10], 100)
+    # A zero-weight stratum is never drawn from, even when the others run out
+    assert alloc.tolist() == [4, 5, 0]
+
+
+def test_empty_strata_get_nothing():
+    alloc = app.allocate_stratified([1, 1], [0, 7], 5)
+    assert alloc.tolist() == [0, 5]
+
+
+def test_sample_stratified_draws_the_quotas_without_repeats():
+    pools = [np.arange(0, 10), np.arange(100, 103), np.arange(200, 220)]
+    picked = app.sample_stratified(pools, [1, 1, 1], 15, np.random.default_rng(0))
+    assert len(picked) == len(set(picked.tolist())) == 15
+    assert sum(100 <= p < 103 for p in picked) == 3
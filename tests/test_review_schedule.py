@@ -0,0 +1,63 @@
+"""SM-2 spaced-repetition updates and their storage."""
+import numpy as np
+
+import app
+
+DAY = 24 * 60
+
+
+def new_record():
+    record = np.zeros(1, dtype=app.SRS_DTYPE)[0]
+    record['ease'] = app.SRS_INITIAL_EASE
+    return record
+
+
+def test_correct_reviews_grow_the_interval():
+    record = new_record()
+    app._sm2_review(record, app.SRS_QUALITY_CORRECT, 0)
+    assert (record['reps'], record['interval'], record['due']) == (1, 1.0, DAY)
+    app._sm2_review(record, app.SRS_QUALITY_CORRECT, 0)
+    assert (record['reps'], record['interval'], record['due']) == (2, 6.0, 6 * DAY)
+    ease = int(record['ease'])
+    app._sm2_review(record, app.SRS_QUALITY_CORRECT, 100)
+    assert record['reps'] == 3
+    assert record['interval'] == np.float32(6.0 * ease / 100)
+    assert record['due'] == 100 + int(record['interval'] * DAY)
+
+
+def test_ease_follows_quality():
+    record = new_record()
+    app._sm2_review(record, 5, 0)
+    assert record['ease'] == app.SRS_INITIAL_EASE + 10
+    record = new_record()
+    app._sm2_review(record, 4, 0)
+    assert record['ease'] == app.SRS_INITIAL_EASE
+    record = new_record()
+    app._sm2_review(record, 3, 0)
+    assert record['ease'] == app.SRS_INITIAL_EASE - 14
+
+
+def test_lapse_resets_the_interval_and_floors_the_ease():
+    record = new_record()
+    for _ in range(3):
+        app._sm2_review(record, app.SRS_QUALITY_CORRECT, 0)
+    for _ in range(10):
+        app._sm2_review(record, app.SRS_QUALITY_WRONG, 0)
+    assert (record['reps'], record['lapses'], record['interval']) == (0, 10, 1.0)
+    assert record['ease'] == app.SRS_MIN_EASE
+    app._sm2_review(record, app.SRS_QUALITY_CORRECT, 0)
+    assert (record['reps'], record['interval']) == (1, 1.0)
+
+
+def test_stored_schedule_matches_the_cached_one():
+    user = '__test_srs__'
+    app.update_schedule(user, [1, 2, 3], [True, True, True], [True, False, True])
+    app.update_schedule(user, [2, 3, 4], [True, True, False], [True, True, False])
+    app.update_schedule(user, [3, 5], [True, True], [False, True])
+    cached = app._schedules[user]['state'].copy()
+
+    stored = app._load_schedule(app.get_store(), user)['state']
+    assert stored.tobytes() == cached.tobytes()
+    assert sorted(stored['ordinal'].tolist()) == [1, 2, 3, 5]
+    record = stored[stored['ordinal'] == 3][0]
+    assert (record['reps'], record['lapses']) == (0, 1)
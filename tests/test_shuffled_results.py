@@ -0,0 +1,81 @@
+"""Round trip of a shuffled quiz: deliver, answer, grade and show the results in delivery order."""
+import pytest
+from flask import template_rendered
+
+import app
+
+MODULE_FILE = 'Module 83 Portfolio Risk and Return Part I'  # has a question whose choices are shuffled
+TEST_USER = '__test__'  # a user whose shuffle plan moves those choices
+
+
+@pytest.fixture
+def client():
+    client = app.app.test_client()
+    with client.session_transaction() as test_session:
+        test_session['user_id'] = TEST_USER
+        test_session['user_role'] = 'user'
+    return client
+
+
+def delivered_questions(client, path):
+    """Questions the quiz page at path was rendered with, in the order it shows them"""
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(context)
+
+    with template_rendered.connected_to(record, app.app):
+        response = client.get(path)
+    assert response.status_code == 200
+    return rendered[-1]['questions']
+
+
+def test_shuffled_results_follow_delivery_order(client):
+    file_order = delivered_questions(client, '/' + MODULE_FILE)
+    delivered = delivered_questions(client, '/' + MODULE_FILE + '?shuffle=1')
+    assert [q['id'] for q in delivered] != [q['id'] for q in file_order]
+    assert any([c['id'] for c in q['choices']] != [c['id'] for c in p['choices']]
+               for q in delivered for p in file_order if p['id'] == q['id'])
+
+    # Answer the page the way it posts answers: the index of the chosen choice as shown
+    answers, expected = [], []
+    for i, q in enumerate(delivered):
+        correct = next((k for k, c in enumerate(q['choices']) if c['id'] == q.get('correct')), None)
+        if correct is None:  # no answer key
+            answers.append(-1)
+            expected.append(-1)
+        elif i % 3 == 0:
+            answers.append(correct)
+            expected.append(1)
+        elif i % 3 == 1:
+            answers.append((correct + 1) % len(q['choices']))
+            expected.append(0)
+        else:
+            answers.append(-1)
+            expected.append(-1)
+
+    response = client.post('/save-quiz-result', json={
+        'file': MODULE_FILE + '.json', 'shuffled': True, 'answers': answers})
+    assert response.status_code == 200
+    result = response.get_json()['result']
+
+    assert result['per_question'] == expected
+    assert result['correct'] == expected.count(1)
+    assert [q['choices'][k]['id'] if k >= 0 else None for q, k in zip(delivered, result['correct_answers'])] == \
+        [q.get('correct') or None for q in delivered]
+
+
+def test_shuffled_and_file_order_sessions_are_saved_separately(client):
+    url = '/api/autosave/' + MODULE_FILE + '.json'
+    file_order = {'answers': [0, -1], 'status': [1, 0], 'current': 1}
+    shuffled = {'answers': [-1, 1], 'status': [0, 1], 'current': 0}
+    assert client.post(url, json=file_order).status_code == 200
+    assert client.post(url + '?shuffled=1', json=shuffled).status_code == 200
+    assert client.get(url).get_json()['state']['answers'] == [0, -1]
+    assert client.get(url + '?shuffled=1').get_json()['state']['answers'] == [-1, 1]
+
+    # Finishing the shuffled session leaves the file-order one to resume
+    response = client.post('/save-quiz-result', json={'file': MODULE_FILE + '.json', 'shuffled': True, 'answers': []})
+    assert response.status_code == 200
+    assert client.get(url + '?shuffled=1').get_json()['state'] is None
+    assert client.get(url).get_json()['state']['answers'] == [0, -1]